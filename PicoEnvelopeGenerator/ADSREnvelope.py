@@ -36,7 +36,6 @@ class ADSREnvelope:
         print (self.update(self))
 
     def start_envelope(self):
-        print("start envelope")
         self.do_envelope = True
         self.note_on = True
         
@@ -53,15 +52,14 @@ class ADSREnvelope:
         ad_arr = np.concatenate((attack_arr, decay_arr), axis=0)
         return ad_arr
 
-    def release(self, current_level = 1500, release_length = 40):
-        if(self.release_length<2):
+    def release(self, current_level = 1500, release_length = 40): # ramp down from wherever the envelope is now
+        if(release_length<2):
             release_arr = np.full((1, ), 0, dtype=np.uint16)
         else:
-            release_arr = np.linspace(self.sustain_level, 0, self.release_length, dtype=np.uint16)
+            release_arr = np.linspace(current_level, 0, release_length, dtype=np.uint16)
         return release_arr
     
     def trigger(self): # trigger the envelope from the start
-        print("trigger")
         self.envelope_pos = 0
         self.release_pos = 0
 #         self.attack_length  = int(chip.read(7) / 4)
@@ -69,9 +67,12 @@ class ADSREnvelope:
 #         self.sustain_level  = int(chip.read(5) * 4)
 #         self.release_length = int(chip.read(4) / 4)
         self.ad_array = self.attack_decay()
+
+    def stop(self): # initiate release phase of the envelope
+        self.note_on = False
+        self.stop_envelope = True
         
     def update(self, tim): # must be run in the loop
-        print("update")
         if (self.do_envelope):
             if (self.note_on):
                 if (self.envelope_pos<len(self.ad_array)): # we're in the attack/decay section
@@ -79,26 +80,26 @@ class ADSREnvelope:
                     out = int(self.ad_array[self.envelope_pos-1])
                 else:
                     out = self.sustain_level # we're in the sustain section
-                print("pos:",self.envelope_pos,"a:", self.attack_length, "d:", self.decay_length, "s:", self.sustain_level, " v:",out)
                     
             else: # we're in the release section
                 if(self.stop_envelope):
                     self.stop_envelope = False
-                    self.rel_array = self.release(self.ad_array[self.envelope_pos-1],self.release_length)
+                    self.rel_array = self.release(self.current_level,self.release_length) # from the level we're outputting
                 if (self.release_pos<len(self.rel_array)-1):
                     self.release_pos = self.release_pos + 1
                     out = int(self.rel_array[self.release_pos])
                 else:
                     out = 0
                     self.do_envelope = False
-                print("pos:",self.release_pos, "s:", self.sustain_level, "r:", self.release_length, " v:",out)
+            self.current_level = out
             #writeToDac(out,0x60,0)
             
 
 
-ax = ADSREnvelope(machine.Timer(), 500)
-ax.trigger()
-ax.start_envelope()
+if __name__ == "__main__":
+    ax = ADSREnvelope(machine.Timer(), 500)
+    ax.trigger()
+    ax.start_envelope()
 #ax.update()
 # while(1):
 #     ax.update()
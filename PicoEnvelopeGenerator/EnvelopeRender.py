@@ -0,0 +1,242 @@
+# Offline envelope renderer for the Pico Envelope Generator by @AxWax
+#
+# Runs the envelope implementations on a PC (using HostSim.py) through
+# scripted gate and pot sequences, records the DAC output for every envelope
+# step and compares it with the golden traces in traces/:
+#
+#   python3 EnvelopeRender.py check   # compare against the golden traces (and make sure
+#                                     # no envelope goes up once the gate is off)
+#   python3 EnvelopeRender.py record  # (re)write the golden traces
+#   python3 EnvelopeRender.py bench   # envelope steps per second
+#
+# The traces are rendered with numpy standing in for ulab, so they pin down
+# the envelope maths rather than ulab's rounding.
+
+import contextlib
+import io
+import os
+import runpy
+import struct
+import sys
+import time
+from array import array
+import HostSim
+
+HostSim.install()
+
+here = os.path.dirname(os.path.abspath(__file__))
+trace_dir = os.path.join(here, "traces")
+
+# each script is a list of (ticks, gate, pots) steps: the pots (raw MCP3008 readings for A, D, S, R)
+# are set first if given, the gate is switched if it differs, then [ticks] samples are rendered
+scripts = {
+    "adsr":             [(100, 1, (120, 80, 375, 160)), (60, 0, None)],
+    "early_release":    [(10, 1, (120, 80, 375, 160)), (60, 0, None)],
+    "release_in_decay": [(40, 1, (120, 80, 375, 160)), (60, 0, None)],
+    "retrigger":        [(60, 1, (120, 80, 375, 160)), (10, 0, None), (60, 1, None), (60, 0, None)],
+    "instant":          [(20, 1, (0, 0, 1023, 0)), (10, 0, None)],
+    "slow":             [(600, 1, (1023, 1023, 100, 1023)), (300, 0, None)],
+    "pot_change":       [(80, 1, (120, 80, 375, 160)), (50, 0, None), (200, 1, (40, 400, 800, 20)), (40, 0, None)],
+}
+
+# the ADSREnvelope class in OLEDDisplay.py, as used by MIDI2CVv2.py
+class ModuleEnvelope:
+    name = "oled"
+
+    def __init__(self):
+        import OLEDDisplay
+        self.adc = OLEDDisplay.ADCRead()
+        self.i2c = (HostSim.FakeI2C(), HostSim.FakeI2C())
+        self.env = OLEDDisplay.ADSREnvelope(HostSim.FakeTimer(), 10, self.adc, OLEDDisplay.DACWrite(self.i2c))
+
+    def pots(self, values):
+        self.adc.chip.values[4:8] = reversed(values)
+
+    def gate(self, on):
+        if (on):
+            self.env.trigger()
+        else:
+            self.env.stop()
+
+    def step(self):
+        self.env.update(None)
+        return self.i2c[1].values.get(0x63, 0) # CV2
+
+# the standalone ADSREnvelope.py
+class StandaloneEnvelope:
+    name = "standalone"
+
+    def __init__(self):
+        import ADSREnvelope
+        self.env = ADSREnvelope.ADSREnvelope(HostSim.FakeTimer(), 10)
+
+    def pots(self, values): # same scaling as ADCRead.update()
+        self.env.attack_length = int(values[0] / 4)
+        self.env.decay_length = int(values[1] / 4)
+        self.env.sustain_level = int(values[2] * 4)
+        self.env.release_length = int(values[3] / 4)
+
+    def gate(self, on):
+        if (on):
+            self.env.trigger()
+            self.env.start_envelope()
+        else:
+            self.env.stop()
+
+    def step(self):
+        self.env.update(None)
+        return self.env.current_level
+
+# the global envelope() in PicoEnvelopeGenerator.py
+class ScriptEnvelope:
+    name = "script"
+
+    def __init__(self):
+        self.g = runpy.run_path(os.path.join(here, "PicoEnvelopeGenerator.py"), run_name = "render")["envelope"].__globals__
+
+    def pots(self, values):
+        self.g["chip"].values[4:8] = reversed(values)
+
+    def gate(self, on): # what doMidiNoteOn() / doMidiNoteOff() do
+        self.g["note_on"] = bool(on)
+        if (on):
+            self.g["start_envelope"] = True
+        else:
+            self.g["stop_envelope"] = True
+
+    def step(self):
+        self.g["envelope"](None)
+        return self.g["i2c"][0].values.get(0x60, 0)
+
+implementations = (ModuleEnvelope, StandaloneEnvelope, ScriptEnvelope)
+
+def play(env, script, out): # runs [script] on [env] and appends the samples to [out], returns the time spent in step()
+    gate = 0
+    took = 0
+    with contextlib.redirect_stdout(io.StringIO()): # keep the envelopes' debug output out of the way
+        for ticks, new_gate, pots in script:
+            if (pots):
+                env.pots(pots)
+            if (new_gate != gate):
+                gate = new_gate
+                env.gate(gate)
+            start = time.perf_counter()
+            for i in range(ticks):
+                out.append(env.step())
+            took = took + time.perf_counter() - start
+    return took
+
+def render(impl, script):
+    out = array("H")
+    play(impl(), script, out)
+    return out
+
+# trace files: "ENVT", version, sample count, then (value, run length) pairs, all little endian
+def write_trace(path, samples):
+    runs = []
+    for value in samples:
+        if (runs and runs[-1][0] == value and runs[-1][1] < 0xFFFF):
+            runs[-1][1] = runs[-1][1] + 1
+        else:
+            runs.append([value, 1])
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sBI", b"ENVT", 1, len(samples)))
+        for value, run in runs:
+            f.write(struct.pack("<HH", value, run))
+
+def read_trace(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, count = struct.unpack_from("<4sBI", data)
+    if (magic != b"ENVT" or version != 1):
+        raise ValueError("not an envelope trace: " + path)
+    samples = array("H")
+    for pos in range(struct.calcsize("<4sBI"), len(data), 4):
+        value, run = struct.unpack_from("<HH", data, pos)
+        samples.extend([value] * run)
+    if (len(samples) != count):
+        raise ValueError("truncated envelope trace: " + path)
+    return samples
+
+def diff(expected, actual): # returns a description of the first difference, or None if they match
+    for i in range(min(len(expected), len(actual))):
+        if (expected[i] != actual[i]):
+            count = sum(1 for a, b in zip(expected, actual) if a != b)
+            return "sample %d: expected %d, got %d (%d samples differ)" % (i, expected[i], actual[i], count)
+    if (len(expected) != len(actual)):
+        return "expected %d samples, got %d" % (len(expected), len(actual))
+    return None
+
+def gates(script): # the gate for every sample [script] renders
+    out = []
+    for ticks, gate, pots in script:
+        out.extend([gate] * ticks)
+    return out
+
+def rises(samples, gate): # returns a description of the first sample that goes up while the gate is off, or None
+    for i in range(1, len(samples)):
+        if (not gate[i] and samples[i] > samples[i - 1]):
+            return "sample %d: rises from %d to %d after the gate went off" % (i, samples[i - 1], samples[i])
+    return None
+
+def trace_path(impl, name):
+    return os.path.join(trace_dir, "%s_%s.trace" % (impl.name, name))
+
+def available():
+    found = []
+    for impl in implementations:
+        try:
+            impl()
+        except ImportError as e: # e.g. SimpleMIDIDecoder.py hasn't been downloaded
+            print("skipping %s: %s" % (impl.name, e))
+            continue
+        found.append(impl)
+    return found
+
+def record():
+    os.makedirs(trace_dir, exist_ok = True)
+    for impl in available():
+        for name, script in scripts.items():
+            samples = render(impl, script)
+            result = rises(samples, gates(script))
+            if (result):
+                print("NOT recording %s %s: %s" % (impl.name, name, result))
+                continue
+            write_trace(trace_path(impl, name), samples)
+            print("recorded", impl.name, name)
+
+def check():
+    failed = 0
+    for impl in available():
+        for name, script in scripts.items():
+            samples = render(impl, script)
+            result = diff(read_trace(trace_path(impl, name)), samples) or rises(samples, gates(script))
+            if (result):
+                failed = failed + 1
+                print("FAIL %s %s: %s" % (impl.name, name, result))
+            else:
+                print("ok   %s %s" % (impl.name, name))
+    return failed
+
+def bench(seconds = 1):
+    for impl in available():
+        samples = 0
+        took = 0
+        for script in scripts.values():
+            env = impl() # built once per script (the script one runs the whole of PicoEnvelopeGenerator.py), not timed
+            spent = 0
+            while (spent < seconds / len(scripts)):
+                out = array("H")
+                spent = spent + play(env, script, out)
+                samples = samples + len(out)
+            took = took + spent
+        print("%s: %d samples/s" % (impl.name, samples / took))
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if (command == "record"):
+        record()
+    elif (command == "bench"):
+        bench()
+    else:
+        sys.exit(1 if check() else 0)
@@ -0,0 +1,56 @@
+from array import array
+
+MAX_STAGE = 256 # longest attack, decay or release phase in steps (the pots read 0 - 1023, divided by 4)
+
+# fill [buf] with [num] steps from [start] towards [stop], the same values numpy/ulab linspace gives for uint16
+def ramp(buf, offset, start, stop, num, endpoint):
+    div = num - 1 if endpoint else num
+    for i in range(num): # integer maths, a float step would be boxed on the heap
+        buf[offset + i] = start + (stop - start) * i // div
+    if (endpoint):
+        buf[offset + num - 1] = stop
+    return num
+
+class EnvelopeStages:
+    # the phases live in preallocated arrays and are only recalculated when the pots (or the level the release starts
+    # from) change, so playing notes doesn't touch the heap
+    __slots__ = ("full_level", "ad_array", "ad_len", "ad_key", "rel_array", "rel_len", "rel_key")
+
+    def __init__(self, full_level = 4000):
+        self.full_level = full_level
+        self.ad_array = array("H", bytes(2 * 2 * MAX_STAGE))
+        self.ad_len = 0
+        self.ad_key = -1
+        self.rel_array = array("H", bytes(2 * MAX_STAGE))
+        self.rel_len = 0
+        self.rel_key = -1
+
+    def attack_decay(self, a, d, s): # attack up to full level over [a] steps, then decay to [s] over [d] steps
+        a = min(a, MAX_STAGE - 1)
+        d = min(d, MAX_STAGE - 1)
+        key = (a << 21) | (d << 13) | s
+        if (key == self.ad_key):
+            return
+        self.ad_key = key
+        if(a<2):
+            self.ad_array[0] = self.full_level
+            self.ad_len = 1
+        else:
+            self.ad_len = ramp(self.ad_array, 0, 0, self.full_level, a, False)
+        if(d<2):
+            self.ad_array[self.ad_len] = s
+            self.ad_len = self.ad_len + 1
+        else:
+            self.ad_len = self.ad_len + ramp(self.ad_array, self.ad_len, self.full_level, s, d, False)
+
+    def release(self, level, r): # ramp down from [level] (wherever the envelope is now) over [r] steps
+        r = min(r, MAX_STAGE - 1)
+        key = (level << 8) | r
+        if (key == self.rel_key):
+            return
+        self.rel_key = key
+        if(r<2):
+            self.rel_array[0] = 0
+            self.rel_len = 1
+        else:
+            self.rel_len = ramp(self.rel_array, 0, level, 0, r, True)
@@ -0,0 +1,837 @@
+# Host simulation for the Pico projects by @AxWax
+#
+# Stand-ins for the Pico peripherals so the modules in this folder can be run
+# and measured on a PC with regular Python, e.g.
+#
+#   python3 HostSim.py [file.mid] [--allow-skips]
+#
+# Checks that need SimpleMIDIDecoder.py are skipped when it hasn't been
+# downloaded, and the run then fails unless --allow-skips is given.
+#
+# Time is simulated: nothing here ever sleeps, the clock only moves when
+# advance_ms() is called. Runs using asyncio switch to the real clock with
+# use_realtime().
+
+import random
+import time
+
+# simulated clock
+now_us = 0
+realtime = False
+
+skipped = [] # checks that couldn't run
+
+def skip(what, e):
+    print("skipping %s: %s" % (what, e))
+    skipped.append(what)
+
+def use_realtime(on = True):
+    global realtime
+    realtime = on
+
+def advance_us(us):
+    global now_us
+    now_us = now_us + int(us)
+
+def advance_ms(ms):
+    advance_us(ms * 1000)
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+def ticks_us():
+    if (realtime):
+        return int(time.perf_counter() * 1000000)
+    return now_us
+
+def ticks_diff(a, b):
+    return a - b
+
+def ticks_add(a, b):
+    return a + b
+
+def sleep_us(us):
+    if (realtime):
+        time.sleep(us / 1000000)
+    else:
+        advance_us(us)
+
+# machine.Timer: the simulation calls fire() instead of a hardware interrupt
+class FakeTimer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id = -1):
+        self.period = 0
+        self.callback = None
+        self.next_due = 0
+
+    def init(self, period = 1000, mode = 1, callback = None):
+        self.period = period
+        self.callback = callback
+        self.next_due = ticks_ms() + period
+
+    def deinit(self):
+        self.callback = None
+
+    def fire(self): # run the callback if the timer is due
+        if (self.callback and ticks_diff(ticks_ms(), self.next_due) >= 0):
+            self.next_due = self.next_due + self.period
+            self.callback(self)
+
+# machine.ADC fed from a list of readings (the last one is repeated)
+class FakeADC:
+    def __init__(self, trace):
+        self.trace = trace
+        self.pos = 0
+        self.reads = 0
+
+    def read_u16(self):
+        value = self.trace[min(self.pos, len(self.trace) - 1)]
+        self.pos = self.pos + 1
+        self.reads = self.reads + 1
+        return value
+
+# machine.I2C, each write takes as long as it would on the bus (9 bits per byte plus the address)
+class FakeI2C:
+    def __init__(self, id = 0, sda = None, scl = None, freq = 400000):
+        self.freq = freq
+        self.writes = 0
+        self.values = {} # last value written to each MCP4725
+
+    def writeto(self, addr, buf):
+        self.writes = self.writes + 1
+        if (len(buf) == 2):
+            self.values[addr] = (buf[0] << 8) | buf[1]
+        advance_us((len(buf) + 1) * 9 * 1000000 / self.freq)
+
+    def writevto(self, addr, vector):
+        self.writes = self.writes + 1
+        advance_us((sum(len(buf) for buf in vector) + 1) * 9 * 1000000 / self.freq)
+
+class FakePin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode = None):
+        self.id = id
+        self.state = 0
+
+    def value(self, v = None):
+        if (v is None):
+            return self.state
+        self.state = v
+
+class FakeSPI:
+    def __init__(self, id = 0, **kwargs):
+        pass
+
+# mcp3008.MCP3008, the pots are set through [values]
+class FakeMCP3008:
+    def __init__(self, spi, cs):
+        self.values = [512] * 8
+
+    def read(self, channel):
+        return self.values[channel]
+
+# ssd1306.SSD1306_I2C, only the bus traffic is simulated
+class FakeOLED:
+    def __init__(self, width, height, i2c, addr = 0x3c):
+        self.i2c = i2c
+        self.addr = addr
+        self.buffer = bytearray(width * height // 8)
+
+    def fill(self, c):
+        pass
+
+    def text(self, s, x, y):
+        pass
+
+    def line(self, x1, y1, x2, y2, c):
+        pass
+
+    def write_cmd(self, cmd):
+        self.i2c.writeto(self.addr, bytes((0x80, cmd)))
+
+    def write_data(self, buf):
+        self.i2c.writevto(self.addr, (b"\x40", buf))
+
+    def show(self):
+        for cmd in (0x21, 0, 127, 0x22, 0, 7):
+            self.write_cmd(cmd)
+        self.write_data(self.buffer)
+
+# machine.UART, the test feeds it bytes and stream() gives the MIDIRuntime something to await
+class VirtualUART:
+    def __init__(self, id = 0, baudrate = 31250, tx = None, rx = None):
+        self.rx = bytearray()
+        self.tx_bytes = 0
+        self.event = None
+
+    def feed(self, data):
+        self.rx.extend(data)
+        if (self.event):
+            self.event.set()
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n = 1):
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def write(self, buf):
+        self.tx_bytes = self.tx_bytes + len(buf)
+
+    def stream(self):
+        import asyncio
+        self.event = asyncio.Event()
+        return VirtualStream(self)
+
+class VirtualStream:
+    def __init__(self, uart):
+        self.uart = uart
+
+    async def read(self, n):
+        while (not self.uart.rx):
+            self.uart.event.clear()
+            await self.uart.event.wait()
+        return self.uart.read(n)
+
+    async def readinto(self, buf):
+        data = await self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+# stands in for SimpleMIDIDecoder, counts status bytes and can be made artificially slow
+class CountingDecoder:
+    def __init__(self, cost_us = 0):
+        self.cost_us = cost_us
+        self.bytes = 0
+        self.messages = 0
+
+    def read(self, b):
+        self.bytes = self.bytes + 1
+        if (b & 0x80):
+            self.messages = self.messages + 1
+        if (self.cost_us):
+            end = ticks_us() + self.cost_us
+            while (ticks_us() < end):
+                pass
+
+# neopixel.Neopixel, counts what would have been sent to the PIO
+class FakeStrip:
+    def __init__(self, count):
+        self.pixels = [(0, 0, 0)] * count
+        self.brightnessvalue = 255
+        self.shows = 0
+        self.brightness_calls = 0
+
+    def brightness(self, brightness = None):
+        if (brightness is None):
+            return self.brightnessvalue
+        self.brightness_calls = self.brightness_calls + 1
+        self.brightnessvalue = brightness
+
+    def fill(self, rgb):
+        self.pixels = [rgb] * len(self.pixels)
+
+    def set_pixel(self, pixel_num, rgb):
+        self.pixels[pixel_num] = rgb
+
+    def show(self):
+        self.shows = self.shows + 1
+
+# register the stand-ins as the MicroPython modules, so the project files can be imported as they are
+# (SimpleMIDIDecoder.py still has to be downloaded, see PicoMIDItoCV/README.md)
+def install():
+    import sys
+    import types
+    machine = types.ModuleType("machine")
+    machine.Pin = FakePin
+    machine.ADC = lambda pin: FakeADC([0])
+    machine.I2C = FakeI2C
+    machine.SPI = FakeSPI
+    machine.UART = VirtualUART
+    machine.Timer = FakeTimer
+    neopixel = types.ModuleType("neopixel")
+    neopixel.Neopixel = lambda num_leds, state_machine, pin, mode = "RGB": FakeStrip(num_leds)
+    ssd1306 = types.ModuleType("ssd1306")
+    ssd1306.SSD1306_I2C = FakeOLED
+    mcp3008 = types.ModuleType("mcp3008")
+    mcp3008.MCP3008 = FakeMCP3008
+    ulab = types.ModuleType("ulab") # numpy has everything we use from ulab
+    import numpy
+    ulab.numpy = numpy
+    for module in (machine, neopixel, ssd1306, mcp3008, ulab):
+        sys.modules[module.__name__] = module
+    import struct
+    sys.modules["ustruct"] = struct
+    sys.modules["HostSim"] = sys.modules[__name__]
+
+# synthetic distance sensor: a hand slowly moving over the sensor plus ADC noise
+def noisy_trace(length, noise = 1500, seed = 1, hold = 400):
+    rnd = random.Random(seed)
+    trace = []
+    for i in range(length):
+        level = 20000 + int(15000 * ((i // hold) % 2)) # hand moves every [hold] samples
+        trace.append(max(0, min(65535, level + int(rnd.gauss(0, noise)))))
+    return trace
+
+# the neopixelDraw() the scripts had before LEDRing: brightness() on every call, a new gradient on every change
+class LegacyLEDs:
+    def __init__(self, strip):
+        self.strip = strip
+        self.old_num_pixels = 0
+
+    def draw(self, num_pixels, bright):
+        self.strip.brightness(bright)
+        if (num_pixels == self.old_num_pixels or num_pixels > 16):
+            return
+        self.old_num_pixels = num_pixels
+        self.strip.fill((0, 0, 0))
+        for i in range(num_pixels):
+            self.strip.set_pixel(i, (0, 255, 0))
+        self.strip.show()
+
+# count strip.show() calls per second for the neopixel ring fed by a noisy distance sensor whose hand moves every
+# second, for the old neopixelDraw() and for LEDRing with the raw and the filtered sensor; [draw_ms] is how often
+# the ring is asked to draw (check_distance_sensor() runs every 50 ms)
+def bench_leds(seconds = 10, draw_ms = 50):
+    from LEDRing import LEDRing
+    from SensorFilter import SensorFilter
+    reads = seconds * 1000 // draw_ms
+    hold = 1000 // draw_ms # readings per hand position
+    moves = seconds - 1
+    results = {}
+    for name in ("legacy", "raw", "filtered"):
+        strip = FakeStrip(16)
+        led_timer = FakeTimer()
+        if (name == "legacy"):
+            leds = LegacyLEDs(strip)
+        else:
+            leds = LEDRing(led_timer, 40, strip, 16, (0, 255, 0), (255, 100, 0))
+        if (name == "filtered"):
+            adc = FakeADC(noisy_trace(reads * 16, hold = hold * 16))
+            sensor = SensorFilter(adc, 4, 2, 56, 64)
+        else:
+            adc = FakeADC(noisy_trace(reads, hold = hold))
+        for ms in range(seconds * 1000):
+            advance_ms(1)
+            if (ms % draw_ms == 0): # check_distance_sensor()
+                if (name == "filtered"):
+                    sensor.update()
+                    distance = sensor.value
+                else:
+                    distance = adc.read_u16() // 16
+                leds.draw(16 - distance // 256, 10)
+            led_timer.fire()
+        results[name] = strip
+        print("leds (%s, drawn every %dms): %.1f show()/s, %d brightness() calls, %d hand moves" % (name, draw_ms, strip.shows / seconds, strip.brightness_calls, moves))
+    legacy = results["legacy"]
+    assert legacy.brightness_calls == reads
+    for name in ("raw", "filtered"):
+        strip = results[name]
+        assert strip.brightness_calls == 1, "%s: brightness() should only be sent once" % name
+        assert strip.shows <= seconds * 25 + 1, "%s: more than 25 frames per second" % name
+        assert strip.shows <= legacy.shows, "%s: more frames than the old neopixelDraw()" % name
+    # each move is 4 LEDs, which the filter steps through one frame at a time, but noise shouldn't add any frames
+    filtered = results["filtered"].shows
+    assert moves <= filtered <= moves * 4 + 1, "filtered: %d frames for %d hand moves" % (filtered, moves)
+
+# compare the raw distance sensor CV with the filtered one, for a steady hand and one that moves every second:
+# the filtered CV should only be written when the hand moves, in steps no bigger than the slew limit
+def bench_sensor(seconds = 10):
+    from SensorFilter import SensorFilter
+    ticks = seconds * 20 # check_distance_sensor() runs every 50 ms
+    for name, hold in (("steady", ticks), ("moving", 40)):
+        raw_adc = FakeADC(noisy_trace(ticks, hold = hold))
+        raw = [raw_adc.read_u16() // 16 for i in range(ticks)]
+        trace = noisy_trace(ticks * 16, hold = hold * 16)
+        sensor = SensorFilter(FakeADC(trace), 4, 2, 56, 64) # as in PicoEnvelopeGenerator.py
+        written = []
+        errors = []
+        for i in range(ticks):
+            value = sensor.update()
+            if (value is not None):
+                written.append(value)
+            if (i % hold == hold - 1): # the end of a hand position, the CV should have settled on it
+                level = (20000 + 15000 * ((i // hold) % 2)) // 16 # noisy_trace() without the noise
+                errors.append(abs(sensor.value - level))
+        steps = [abs(written[i] - written[i - 1]) for i in range(1, len(written))] or [0]
+        raw_steps = [abs(raw[i] - raw[i - 1]) for i in range(1, len(raw))]
+        print("sensor %s: raw %d DAC writes, mean step %.1f; filtered %d DAC writes, mean step %.1f, max step %d, settled error %d" % (name, ticks, sum(raw_steps) / len(raw_steps), len(written), sum(steps) / len(steps), max(steps), max(errors)))
+        assert max(errors) <= sensor.deadband >> 2, "%s: settled %d steps off" % (name, max(errors))
+        assert max(steps) <= sensor.slew, "%s: step of %d" % (name, max(steps))
+        if (name == "steady"): # the odd small correction as the average firms up
+            assert len(written) <= 1 + seconds // 2, "steady: %d DAC writes" % len(written)
+        else: # 937 steps per move at 64 per tick
+            moves = ticks // hold - 1
+            assert len(written) <= 1 + moves * (937 // sensor.slew + 4), "moving: %d DAC writes for %d moves" % (len(written), moves)
+    # a noiseless move smaller than the deadband still gets through
+    sensor = SensorFilter(FakeADC([20000] * 16 * 20 + [20800] * 16 * 60), 4, 2, 56, 64)
+    for i in range(80):
+        sensor.update()
+    print("sensor small move: 1250 -> 1300, CV %d" % sensor.value)
+    assert abs(sensor.value - 1300) <= sensor.deadband >> 2, "small move: CV %d" % sensor.value
+
+# run the PicoEnvelopeGenerator workload plus the OLED display through the scheduler, ticked every millisecond
+# like MIDIRuntime.tick() does, and report deadline misses; [chunk] is how much of the display frame is sent
+# per tick (1024 sends the whole frame at once like SSD1306.show())
+def bench_scheduler(seconds = 10, budget_us = 800, chunk = 32):
+    install()
+    import OLEDDisplay
+    from Scheduler import Scheduler
+    i2c = FakeI2C()
+    sched = Scheduler(1, budget_us)
+    envelope = sched.add("envelope", lambda t: i2c.writeto(0x60, bytearray(2)), 2, 0)
+    sched.add("calibration", lambda t: advance_us(2), 100, 2)
+    sched.add("distance", lambda t: (advance_us(16 * 4), i2c.writeto(0x63, bytearray(2))), 50, 2)
+    sched.add("leds", lambda t: advance_us(16 * 24 * 1.25 + 50), 40, 8, True) # 16 pixels at 800kHz
+    oled = OLEDDisplay.OLEDDisplay(sched.timer("display", 9, True), 100, OLEDDisplay.ADCRead(), i2c, chunk)
+    end = now_us + seconds * 1000000
+    due = now_us
+    while (now_us < end):
+        if (now_us < due): # idle until the next tick
+            advance_us(due - now_us)
+        sched.run()
+        due = due + 1000
+        if (now_us > due): # the tick overran, skip ahead like MIDIRuntime.tick()
+            due = now_us
+    print("scheduler, display sent %d bytes per tick:" % chunk)
+    sched.report()
+    return envelope
+
+# push [events_per_sec] note messages through a virtual UART into the asyncio runtime
+def bench_runtime(events_per_sec = 5000, seconds = 2, decode_cost_us = 0):
+    import asyncio
+    from Scheduler import Scheduler
+    from MIDIRuntime import MIDIRuntime, stream
+    use_realtime()
+    uart = VirtualUART()
+    decoder = CountingDecoder(decode_cost_us)
+    sched = Scheduler(1, 800)
+    sched.add("envelope", lambda t: None, 2, 0)
+    runtime = MIDIRuntime(stream(uart), decoder, sched)
+    sent = [0]
+
+    async def play(): # feed the UART every millisecond
+        start = ticks_us()
+        while True:
+            due = (ticks_us() - start) * events_per_sec // 1000000
+            while (sent[0] < due):
+                uart.feed(bytes((0x80 if sent[0] & 1 else 0x90, 60, 100))) # alternate note on / off
+                sent[0] = sent[0] + 1
+            await asyncio.sleep(0.001)
+
+    async def main():
+        try:
+            await asyncio.wait_for(asyncio.gather(play(), runtime.run()), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(main())
+    print("runtime: %d events/s sent, %d/s decoded, %d bytes left in the UART" % (sent[0] / seconds, decoder.messages / seconds, uart.any()))
+    runtime.rx.report("  rx")
+
+# play [notes] notes of varying length and check the heap doesn't grow once everything is set up, first through the
+# envelope and DAC directly, then (if SimpleMIDIDecoder.py is there) as MIDI bytes through the virtual UART, MIDIRuntime,
+# the decoder, the note callbacks, the envelope task and the display of MIDI2CVv2.py; fails if more than [limit] bytes
+# stay allocated, or if a note on, note off or envelope step allocates more than a DAC write plus a few boxed ints
+def soak_memory(notes = 2000, limit = 256):
+    import asyncio
+    import os
+    import runpy
+    import sys
+    import tracemalloc
+    install()
+    import OLEDDisplay
+    from MemStats import MemStats
+    mem = MemStats()
+    adc = OLEDDisplay.ADCRead()
+    adc.chip.values[4:8] = (160, 375, 80, 120) # R, S, D, A
+    dac = OLEDDisplay.DACWrite((FakeI2C(), FakeI2C()))
+    env = OLEDDisplay.ADSREnvelope(FakeTimer(), 10, adc, dac)
+    def note_on(note):
+        dac.playNote(note)
+        env.trigger()
+    trigger = mem.wrap("note on", note_on)
+    stop = mem.wrap("note off", env.stop)
+    update = mem.wrap("envelope", env.update)
+    # regular Python boxes every int above 256, MicroPython doesn't box anything under 2^30; these measure what that
+    # and the simulated I2C cost here, so it can be taken off the figures above
+    write = mem.wrap("DAC write", lambda level: dac.update(level, 1))
+    nothing = mem.wrap("no op", lambda a, b: None)
+    boxed = mem.wrap("boxed int", lambda a, b: (a << 8) | b)
+    rebuilt = 0
+    for i in range(notes + 20):
+        if (i == 10): # leave out the first notes, they build the attack and decay
+            mem.stats.clear()
+        elif (i == 20): # steady state from here on, including the statistics themselves
+            start = mem.heap()
+        key = env.stages.rel_key
+        trigger(40 + (i * 7) % 36)
+        for t in range((i * 13) % 70): # released during the attack (30 steps), the decay (20) or the sustain
+            update(None)
+        stop()
+        for t in range((i * 11) % 50): # and some come back before the release is over
+            update(None)
+        if (env.stages.rel_key != key):
+            rebuilt = rebuilt + 1
+        write(4000 - i % 1000)
+        nothing(4000, 255)
+        boxed(4000 + i, 255)
+    grown = mem.heap() - start
+    print("memory (envelope and DAC): %d notes, heap grew by %d bytes, %d release ramps built" % (notes, grown, rebuilt))
+    mem.report()
+    assert grown <= limit, "the heap grew by %d bytes" % grown
+    assert rebuilt >= notes // 2, "only %d release ramps built, the note lengths don't vary enough" % rebuilt
+    box = mem.stats["boxed int"][2] - mem.stats["no op"][2]
+    allowed = mem.stats["DAC write"][2] + 3 * box # the release key and the ramp's temporaries
+    for name in ("note on", "note off", "envelope"):
+        most = mem.stats[name][2]
+        print("  %s: at most %d bytes a call, %d allowed (a DAC write and 3 boxed ints of %d bytes)" % (name, most, allowed, box))
+        assert most <= allowed, "%s allocates %d bytes, more than a DAC write and 3 boxed ints (%d)" % (name, most, allowed)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        g = runpy.run_path(os.path.join(here, "MIDI2CVv2.py"), run_name = "soak")
+    except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+        skip("the MIDI soak", e)
+        return
+    # only count what the project and the decoder hold on to, not asyncio or the simulation
+    files = [os.path.join(here, name + ".py") for name in ("MIDI2CVv2", "MIDIRuntime", "Scheduler", "OLEDDisplay", "EnvelopeStages", "MemStats")]
+    files.append(os.path.abspath(sys.modules["SimpleMIDIDecoder"].__file__))
+    traced = [tracemalloc.Filter(True, name) for name in files]
+    use_realtime()
+    uart = g["uart"]
+    held = []
+
+    async def play(): # a note on and a note off every 2ms
+        for i in range(notes + 100):
+            if (i == 100): # steady state from here on
+                held.append(tracemalloc.take_snapshot().filter_traces(traced))
+            note = 40 + (i * 7) % 36
+            uart.feed(bytes((0x90, note, 100)))
+            await asyncio.sleep(0.001)
+            uart.feed(bytes((0x80, note, 0)))
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.1) # let the decoder and envelope catch up
+        held.append(tracemalloc.take_snapshot().filter_traces(traced))
+
+    async def main():
+        runtime = asyncio.ensure_future(g["runtime"].run())
+        await play()
+        runtime.cancel()
+
+    if (not tracemalloc.is_tracing()):
+        tracemalloc.start()
+    asyncio.run(main())
+    stats = held[1].compare_to(held[0], "lineno")
+    grown = sum(stat.size_diff for stat in stats)
+    print("memory (MIDI2CVv2 through the runtime): %d notes, %d bytes decoded, heap grew by %d bytes" % (notes, g["runtime"].bytes_decoded, grown))
+    for stat in stats[:3]:
+        if (stat.size_diff > 0):
+            print(" ", stat)
+    assert g["runtime"].bytes_decoded == (notes + 100) * 6, "the decoder fell behind"
+    assert grown <= limit, "the heap grew by %d bytes" % grown
+
+# run each script with its MemStats switched on for a few notes and check every subsystem it schedules and every
+# MIDI callback shows up in the statistics
+def check_accounting():
+    import contextlib
+    import io
+    import os
+    import runpy
+    install()
+    use_realtime(False)
+    import MemStats
+    saved = MemStats.MemStats
+    class Enabled(saved):
+        def __init__(self, enabled = True, log_events = False):
+            saved.__init__(self, True, False)
+    here = os.path.dirname(os.path.abspath(__file__))
+    scripts = (("PicoEnvelopeGenerator", os.path.join(here, "PicoEnvelopeGenerator.py"), ("leds", "calibration", "envelope")),
+               ("PicoMIDItoCVSharp", os.path.join(here, "..", "PicoMIDItoCVSharp", "PicoMIDItoCVSharp.py"), ("leds", "distance", "calibration")),
+               ("MIDI2CVv2", os.path.join(here, "MIDI2CVv2.py"), ("dac", "display", "envelope")))
+    MemStats.MemStats = Enabled
+    try:
+        for name, script, tasks in scripts:
+            try:
+                g = runpy.run_path(script, run_name = "bench")
+            except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+                skip(name + " accounting", e)
+                continue
+            with contextlib.redirect_stdout(io.StringIO()): # the memory task prints its report
+                for note in range(40, 50):
+                    for b in (0x90, note, 100, 0x80, note, 0):
+                        g["md"].read(b)
+                    for t in range(100):
+                        advance_ms(1)
+                        g["sched"].run()
+            stats = g["mem"].stats
+            print("accounting %s: %s" % (name, ", ".join(sorted(stats))))
+            for wanted in tasks + ("note on", "note off", "decode"):
+                assert wanted in stats, "%s doesn't account for %s" % (name, wanted)
+            assert not g["mem"].stack, "%s left a measurement open" % name
+    finally:
+        MemStats.MemStats = saved
+
+# a burst of notes inside one envelope step must leave the envelope following the gate: after a stray note off and
+# [notes] short notes the envelope has to release, with one more note on it has to hold
+def check_gate(notes = 9):
+    import os
+    import runpy
+    install()
+    use_realtime(False)
+    for held in (False, True):
+        try:
+            g = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "MIDI2CVv2.py"), run_name = "bench")
+        except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+            skip("the gate check", e)
+            return
+        md = g["md"]
+        for b in (0x80, 60, 0): # stray note off
+            md.read(b)
+        for i in range(notes):
+            for b in (0x90, 60 + i, 100, 0x80, 60 + i, 0):
+                md.read(b)
+        if (held):
+            for b in (0x90, 72, 100):
+                md.read(b)
+        for ms in range(3000): # long enough for the longest release (255 steps of 10ms)
+            g["sched"].run()
+            advance_ms(1)
+        cv2 = g["i2c"][1].values.get(0x63, 0)
+        print("gate check (%s): gate %d, envelope note on %s, CV2 %d" % ("held" if held else "released", g["gate"].value(), g["env"].note_on, cv2))
+        assert g["env"].note_on == held and g["gate"].value() == held
+        assert (cv2 > 0) == held, "CV2 is %d" % cv2
+
+# MIDI2CVv2.py with a MIDI file playing: a controller change from the player arriving in the middle of a note on from
+# the UART mustn't break either message
+def check_sources():
+    import os
+    import runpy
+    install()
+    use_realtime(False)
+    try:
+        g = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "MIDI2CVv2.py"), run_name = "bench")
+        g = g["doMidiNoteOn"].__globals__ # the live globals, run_path() returns a copy
+    except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+        skip("the MIDI sources check", e)
+        return
+    uart = g["md"]
+    player = g["midi_decoder"]()
+    thru = g["uart"].tx_bytes
+    uart.read(0x90)
+    uart.read(60)
+    for b in (0xB0, 7, 100): # from the file
+        player.read(b)
+    uart.read(100)
+    print("sources check: gate %d, note %d, %d bytes passed through" % (g["gate"].value(), g["current_note"], g["uart"].tx_bytes - thru))
+    assert g["gate"].value() == 1 and g["current_note"] == 60
+    assert g["uart"].tx_bytes - thru == 6 # both messages passed on whole
+
+# write a format 1 Standard MIDI File: a tempo track (120 bpm, then 180 bpm halfway) and [tracks] tracks of 16th notes
+def write_midi_file(path, notes = 1000, tracks = 2, division = 96):
+    def varlen(value):
+        out = bytearray([value & 0x7F])
+        value = value >> 7
+        while (value):
+            out.insert(0, 0x80 | (value & 0x7F))
+            value = value >> 7
+        return out
+    def chunk(kind, data):
+        return kind + len(data).to_bytes(4, "big") + data
+    step = division // 4
+    tempo = bytearray(b"\x00\xff\x51\x03\x07\xa1\x20") # 500000us per quarter note
+    tempo = tempo + varlen(notes * step // 2) + b"\xff\x51\x03\x05\x16\x15" # 333333us per quarter note
+    tempo = tempo + b"\x00\xff\x2f\x00"
+    data = chunk(b"MThd", bytes((0, 1, 0, tracks + 1, division >> 8, division & 0xFF))) + chunk(b"MTrk", bytes(tempo))
+    for t in range(tracks):
+        track = bytearray(b"\x00\xb0\x07\x64") # a controller change, passed through the decoder's thru callback
+        delta = t # offset the tracks by a tick
+        for i in range(notes):
+            note = 40 + (i * 7 + t * 5) % 36
+            track = track + varlen(delta) + bytes((0x90 | t, note, 100)) # note on
+            track = track + varlen(step - 1) + bytes((note, 0)) # note off as note on with velocity 0, using running status
+            delta = 1
+        track = track + b"\x00\xff\x2f\x00"
+        data = data + chunk(b"MTrk", bytes(track))
+    with open(path, "wb") as f:
+        f.write(data)
+
+# MIDIFilePlayer on hand made files: a format 2 file plays its tracks one after the other, and a meta event
+# cancels running status
+def check_player():
+    import os
+    import tempfile
+    from MIDIFilePlayer import MIDIFilePlayer
+    use_realtime(False)
+    def chunk(kind, data):
+        return kind + len(data).to_bytes(4, "big") + data
+    class Recorder:
+        def __init__(self):
+            self.bytes = bytearray()
+        def read(self, b):
+            self.bytes.append(b)
+    path = os.path.join(tempfile.mkdtemp(), "check.mid")
+    # format 2, two tracks of one quarter note each (96 ticks, 0.5s at 120bpm)
+    data = chunk(b"MThd", bytes((0, 2, 0, 2, 0, 96)))
+    for note in (60, 62):
+        data = data + chunk(b"MTrk", bytes((0, 0x90, note, 100, 96, 0x80, note, 0, 0, 0xFF, 0x2F, 0)))
+    with open(path, "wb") as f:
+        f.write(data)
+    recorder = Recorder()
+    player = MIDIFilePlayer(path, recorder)
+    took = player.play()
+    player.close()
+    print("player format 2: %d events in %.3fs" % (player.events, took / 1000000))
+    assert bytes(recorder.bytes) == bytes((0x90, 60, 100, 0x80, 60, 0, 0x90, 62, 100, 0x80, 62, 0)) and took == 1000000
+    # format 2 with times that don't divide evenly: the first track's rounding mustn't carry into the second
+    # (2 ticks is 10416.7us, then the second track's 1 tick is 5208.3us from its own start)
+    data = chunk(b"MThd", bytes((0, 2, 0, 2, 0, 96)))
+    data = data + chunk(b"MTrk", bytes((0, 0x90, 60, 100, 2, 0x80, 60, 0, 0, 0xFF, 0x2F, 0)))
+    data = data + chunk(b"MTrk", bytes((1, 0x90, 62, 100, 0, 0x80, 62, 0, 0, 0xFF, 0x2F, 0)))
+    with open(path, "wb") as f:
+        f.write(data)
+    player = MIDIFilePlayer(path, Recorder())
+    took = player.play()
+    player.close()
+    assert took == 10416 + 5208, "format 2 rounding carried over: %dus" % took
+    # a file too short to hold a header
+    with open(path, "wb") as f:
+        f.write(b"MThd")
+    try:
+        MIDIFilePlayer(path, Recorder())
+        assert False, "truncated header accepted"
+    except ValueError:
+        pass
+    # a text meta event between a note on and a data byte that would be running status
+    data = chunk(b"MThd", bytes((0, 0, 0, 1, 0, 96))) + chunk(b"MTrk", bytes((0, 0x90, 60, 100, 0, 0xFF, 0x01, 1, 65, 10, 60, 0, 0, 0xFF, 0x2F, 0)))
+    with open(path, "wb") as f:
+        f.write(data)
+    recorder = Recorder()
+    player = MIDIFilePlayer(path, recorder)
+    player.play()
+    player.close()
+    os.remove(path)
+    print("player running status after a meta event: %d events" % player.events)
+    assert bytes(recorder.bytes) == bytes((0x90, 60, 100))
+
+# play a Standard MIDI File through PicoMIDItoCV.py and MIDI2CVv2.py: once in simulated time to check the timing,
+# then as fast as possible to measure decode and CV throughput ([path] defaults to a generated file)
+def bench_player(path = None):
+    import os
+    import runpy
+    from MIDIFilePlayer import MIDIFilePlayer
+    install()
+    if (path is None):
+        import tempfile
+        path = os.path.join(tempfile.mkdtemp(), "bench.mid")
+        write_midi_file(path, notes = 2000, tracks = 2)
+    here = os.path.dirname(os.path.abspath(__file__))
+    use_realtime(False)
+    player = MIDIFilePlayer(path, CountingDecoder())
+    took = player.play()
+    print("player: %d events in %.3fs of simulated time, latest event %dus late" % (player.events, took / 1000000, player.max_late_us))
+    player.close()
+    use_realtime()
+    for name, script in (("PicoMIDItoCV", os.path.join(here, "..", "PicoMIDItoCV", "PicoMIDItoCV.py")), ("MIDI2CVv2", os.path.join(here, "MIDI2CVv2.py"))):
+        try:
+            g = runpy.run_path(script, run_name = "bench")
+        except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+            skip(name, e)
+            continue
+        i2c = g["i2c"] if isinstance(g["i2c"], tuple) else (g["i2c"],)
+        sched = g.get("sched")
+        player = MIDIFilePlayer(path, g["md"])
+        start = ticks_us()
+        while (player.advance() >= 0):
+            player.emit()
+            if (sched): # let the envelope keep up
+                sched.run()
+        took = (ticks_us() - start) / 1000000
+        print("%s: %d events/s, %d DAC writes/s (max speed)" % (name, player.events / took, sum(bus.writes for bus in i2c) / took))
+        player.close()
+
+# PicoMIDItoCVSharp/ carries its own copies of the shared modules: check they're still the same as the ones here,
+# then run PicoMIDItoCVSharp.py with its copies for [seconds] of real time with [events_per_sec] notes coming in
+def bench_sharp(seconds = 2, events_per_sec = 1000):
+    import asyncio
+    import os
+    import runpy
+    import sys
+    install()
+    here = os.path.dirname(os.path.abspath(__file__))
+    sharp = os.path.join(here, "..", "PicoMIDItoCVSharp")
+    shared = ("LEDRing", "SensorFilter", "Scheduler", "MIDIRuntime", "MemStats")
+    for name in shared:
+        with open(os.path.join(here, name + ".py"), "rb") as a, open(os.path.join(sharp, name + ".py"), "rb") as b:
+            assert a.read() == b.read(), "PicoMIDItoCVSharp/%s.py differs from PicoEnvelopeGenerator/%s.py" % (name, name)
+    saved = dict((name, sys.modules.pop(name)) for name in shared if name in sys.modules)
+    sys.path.insert(0, sharp)
+    try:
+        try:
+            g = runpy.run_path(os.path.join(sharp, "PicoMIDItoCVSharp.py"), run_name = "bench")
+        except ImportError as e: # SimpleMIDIDecoder.py hasn't been downloaded
+            skip("PicoMIDItoCVSharp", e)
+            return
+        for name in shared:
+            assert os.path.dirname(os.path.abspath(sys.modules[name].__file__)) == os.path.abspath(sharp), name
+    finally:
+        sys.path.remove(sharp)
+        for name in shared:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+    use_realtime()
+    uart = g["uart"]
+    sent = [0]
+
+    async def play(): # alternate note on / off every millisecond
+        start = ticks_us()
+        while True:
+            due = (ticks_us() - start) * events_per_sec // 1000000
+            while (sent[0] < due):
+                uart.feed(bytes((0x80 if sent[0] & 1 else 0x90, 40 + sent[0] % 24, 100)))
+                sent[0] = sent[0] + 1
+            await asyncio.sleep(0.001)
+
+    async def main():
+        try:
+            await asyncio.wait_for(asyncio.gather(play(), g["runtime"].run()), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(main())
+    sched = g["sched"]
+    runs = dict((task.name, task.runs) for task in sched.tasks)
+    print("PicoMIDItoCVSharp: %d notes sent, %d bytes decoded, CV1 writes: %d, tasks run: %s" % (sent[0], g["runtime"].bytes_decoded, g["i2c"][1].writes, runs))
+    assert g["runtime"].bytes_decoded >= sent[0] * 3 * 0.9, "the decoder fell behind"
+    assert runs["distance"] >= seconds * 20 * 0.9 and runs["calibration"] >= seconds * 10 * 0.9
+
+if __name__ == "__main__":
+    import sys
+    sys.modules["HostSim"] = sys.modules["__main__"] # the modules being measured import the clock from here
+    args = [arg for arg in sys.argv[1:] if arg != "--allow-skips"]
+    bench_leds()
+    bench_leds(draw_ms = 1)
+    bench_sensor()
+    envelope = bench_scheduler(chunk = 1024)
+    assert envelope.misses > 0 # the whole frame at once holds up the envelope
+    envelope = bench_scheduler()
+    assert envelope.misses == 0 and envelope.max_late_us < 1000, "envelope %d misses, %dus late" % (envelope.misses, envelope.max_late_us)
+    bench_runtime()
+    bench_runtime(decode_cost_us = 100)
+    bench_sharp()
+    soak_memory()
+    check_accounting()
+    check_gate()
+    check_sources()
+    check_player()
+    bench_player(args[0] if args else None)
+    if (skipped):
+        print("%d checks skipped: %s" % (len(skipped), ", ".join(skipped)))
+        if ("--allow-skips" not in sys.argv):
+            sys.exit(1)
@@ -1,9 +1,23 @@
 import machine
-import ustruct
 import SimpleMIDIDecoder
 from OLEDDisplay import *
+from Scheduler import Scheduler
+from MIDIRuntime import MIDIRuntime, stream
+try:
+    import uasyncio as asyncio
+except ImportError: # running on the host, see HostSim.py
+    import asyncio
+from MemStats import MemStats
+from MIDIFilePlayer import MIDIFilePlayer
 
-note_on = False
+# Standard MIDI File to play on a loop through the decoder, e.g. "song.mid" (None to only listen to the UART)
+MIDI_FILE = None
+
+# set to True to log the heap allocations per subsystem and per MIDI event (slows everything down)
+mem = MemStats(enabled = False, log_events = True)
+
+note_on = False    # the gate, as last set by the MIDI callbacks
+retrigger = False  # a note has started since the envelope last looked
 
 # set up gate pin
 gate = machine.Pin(27, machine.Pin.OUT)
@@ -13,30 +27,35 @@ gate.value(0)
 uart = machine.UART(0,31250,tx=machine.Pin(12),rx=machine.Pin(13)) # UART0 on pins 12,13
 
 # MIDI Thru
+thru2 = bytearray(2) # preallocated, so passing messages on doesn't allocate
+thru3 = bytearray(3)
 def midi_send(cmd, ch, b1, b2):
     if (b2 == -1):
-        uart.write(ustruct.pack("bb",cmd+ch,b1))
+        thru2[0] = (cmd+ch) & 0xFF
+        thru2[1] = b1
+        uart.write(thru2)
     else:
-        uart.write(ustruct.pack("bbb",cmd+ch,b1,b2))
+        thru3[0] = (cmd+ch) & 0xFF
+        thru3[1] = b1
+        thru3[2] = b2
+        uart.write(thru3)
         
 # MIDI callback routines
 def doMidiNoteOn(ch, cmd, note, vel):
-    global note_on, current_note, dac, env
+    global note_on, current_note, dac, retrigger
     if(not note_on):
         dacV = dac.playNote(note)
         gate.value(1)
         note_on = True
         current_note = note
-        env.trigger()
-        print("note:",note)
+        retrigger = True
     midi_send(cmd, ch, note, vel)
 
 def doMidiNoteOff(ch, cmd, note, vel):
-    global note_on,stop_envelope, env   
+    global note_on,stop_envelope
     gate.value(0)
     note_on = False
     stop_envelope = True
-    env.stop()
     midi_send(cmd, ch, note, vel)
 
 def doMidiThru(ch, cmd, d1, d2):
@@ -47,23 +66,50 @@ def doMidiThru(ch, cmd, d1, d2):
         transport_control(cmd)
     return
 
+# envelope task, picks up the gate from the MIDI callbacks before stepping the envelope: however many notes came
+# in since the last step, only whether one started and where the gate ended up matter
+def envelope_tick(t):
+    global retrigger
+    if (retrigger):
+        retrigger = False
+        env.trigger()
+    if (not note_on and env.note_on):
+        env.stop()
+    env.update(t)
 
 adc = ADCRead()
 i2c = machine.I2C(0,sda=machine.Pin(8), scl=machine.Pin(9), freq=400000), machine.I2C(1,sda=machine.Pin(2), scl=machine.Pin(3), freq=400000) # set up I2C bus 0 and 1
 dac = DACWrite(i2c)
-oled = OLEDDisplay(machine.Timer(), 100, adc, i2c[0])
-env = ADSREnvelope(machine.Timer(), 10, adc, dac) #2
+dac.update = mem.wrap("dac", dac.update)
+sched = Scheduler(1, 800) # one tick source for everything, the envelope always runs first
+display_timer = sched.timer("display", 8, True)
+oled = OLEDDisplay(display_timer, 100, adc, i2c[0])
+display_timer.init(period = 1, callback = mem.wrap("display", oled.update)) # a new frame every 100ms, sent a chunk per tick
+envelope_timer = sched.timer("envelope", 0)
+env = ADSREnvelope(envelope_timer, 10, adc, dac) #2
+envelope_timer.init(period = 10, callback = mem.wrap("envelope", envelope_tick))
 env.trigger()
 env.stop()
+if (mem.enabled):
+    sched.add("memory", lambda t: mem.report(), 10000, 9, True) # print the statistics every 10 seconds
 
-# initialise MIDI decoder and set up callbacks
-md = SimpleMIDIDecoder.SimpleMIDIDecoder()
-md.cbNoteOn (doMidiNoteOn)
-md.cbNoteOff (doMidiNoteOff)
-md.cbThru (doMidiThru)
-print("start")
-# the loop
-while True:
-    # Check for MIDI messages
-    if (uart.any()):
-        md.read(uart.read(1)[0])
+# initialise MIDI decoders and set up callbacks, the UART and the MIDI file player each need their own decoder
+# (a message split across UART reads would otherwise get the player's bytes mixed into it)
+def midi_decoder():
+    decoder = SimpleMIDIDecoder.SimpleMIDIDecoder()
+    decoder.cbNoteOn (mem.wrap("note on", doMidiNoteOn, True))
+    decoder.cbNoteOff (mem.wrap("note off", doMidiNoteOff, True))
+    decoder.cbThru (mem.wrap("thru", doMidiThru, True))
+    decoder.read = mem.wrap("decode", decoder.read)
+    return decoder
+
+md = midi_decoder()
+
+# the UART reader, MIDI decoder and scheduler tick run as separate tasks
+runtime = MIDIRuntime(stream(uart), md, sched)
+if __name__ == "__main__":
+    print("start")
+    if (MIDI_FILE):
+        asyncio.run(runtime.run(MIDIFilePlayer(MIDI_FILE, midi_decoder()).play_async(True)))
+    else:
+        asyncio.run(runtime.run())
@@ -0,0 +1,221 @@
+try:
+    from uasyncio import sleep_ms # unlike sleep() this doesn't allocate
+    from time import ticks_us, ticks_diff, ticks_add, sleep_us
+except ImportError: # running on the host, see HostSim.py
+    import asyncio
+    from HostSim import ticks_us, ticks_diff, ticks_add, sleep_us
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+# one MTrk chunk, read through its own small buffer so the file never has to fit in memory
+class Track:
+    def __init__(self, f, start, length, bufsize):
+        self.f = f
+        self.start = start
+        self.end = start + length
+        self.buf = bytearray(bufsize)
+        self.msg = bytearray(3) # the pending channel message
+        self.rewind()
+
+    def rewind(self):
+        self.pos = self.start  # file offset of buf[0]
+        self.idx = 0
+        self.len = 0
+        self.status = 0        # running status
+        self.msg_len = 0
+        self.tick = 0          # absolute time of the pending event
+        self.done = False
+        self.tempo = -1        # tempo set by the pending event, -1 if it isn't a tempo change
+        self.next_event()
+
+    def byte(self):
+        if (self.idx == self.len): # refill the buffer
+            self.pos = self.pos + self.len
+            self.f.seek(self.pos)
+            self.len = min(self.f.readinto(self.buf) or 0, self.end - self.pos) # don't run into the next chunk
+            self.idx = 0
+            if (self.len <= 0):
+                self.len = 0
+                raise EOFError
+        b = self.buf[self.idx]
+        self.idx = self.idx + 1
+        return b
+
+    def varlen(self): # variable length quantity
+        value = 0
+        while True:
+            b = self.byte()
+            value = (value << 7) | (b & 0x7F)
+            if (not b & 0x80):
+                return value
+
+    def skip(self, n):
+        for i in range(n):
+            self.byte()
+
+    def next_event(self): # read up to the next event that matters: a channel message, tempo change or the end
+        self.msg_len = 0
+        self.tempo = -1
+        try:
+            while True:
+                self.tick = self.tick + self.varlen()
+                b = self.byte()
+                if (b == 0xFF): # meta event
+                    self.status = 0 # meta and sysex events cancel running status
+                    kind = self.byte()
+                    length = self.varlen()
+                    if (kind == 0x2F): # end of track
+                        self.done = True
+                        return
+                    if (kind == 0x51 and length == 3):
+                        self.tempo = (self.byte() << 16) | (self.byte() << 8) | self.byte()
+                        return
+                    self.skip(length)
+                elif (b == 0xF0 or b == 0xF7): # sysex, not passed on
+                    self.status = 0
+                    self.skip(self.varlen())
+                else:
+                    if (b & 0x80):
+                        self.status = b
+                        data = self.byte()
+                    elif (self.status): # running status, this was already the first data byte
+                        data = b
+                    else: # a data byte with no status to go with it, the rest of the track can't be trusted
+                        self.done = True
+                        return
+                    self.msg[0] = self.status
+                    self.msg[1] = data
+                    self.msg_len = 2
+                    if (self.status & 0xE0 != 0xC0): # everything but program change and channel pressure has two data bytes
+                        self.msg[2] = self.byte()
+                        self.msg_len = 3
+                    return
+        except EOFError: # missing end of track event
+            self.done = True
+
+class MIDIFilePlayer:
+    def __init__(self, path, decoder, bufsize = 32):
+        self.decoder = decoder
+        self.f = open(path, "rb")
+        header = self.f.read(14)
+        if (len(header) < 14 or header[0:4] != b"MThd"):
+            raise ValueError("not a Standard MIDI File")
+        self.format = (header[8] << 8) | header[9] # 0 and 1 play all tracks together, 2 plays them one after the other
+        if (self.format > 2):
+            raise ValueError("unknown Standard MIDI File format")
+        division = (header[12] << 8) | header[13]
+        if (division & 0x8000): # SMPTE: frames per second and ticks per frame
+            self.ticks_per_second = (256 - (division >> 8)) * (division & 0xFF)
+            self.division = 0
+        else:
+            self.division = division # ticks per quarter note
+
+        # find the tracks
+        self.tracks = []
+        pos = 8 + ((header[4] << 24) | (header[5] << 16) | (header[6] << 8) | header[7])
+        while True:
+            self.f.seek(pos)
+            chunk = self.f.read(8)
+            if (len(chunk) < 8):
+                break
+            length = (chunk[4] << 24) | (chunk[5] << 16) | (chunk[6] << 8) | chunk[7]
+            if (chunk[0:4] == b"MTrk"):
+                self.tracks.append(Track(self.f, pos + 8, length, bufsize))
+            pos = pos + 8 + length
+        self.rewind()
+
+    def rewind(self):
+        for track in self.tracks:
+            track.rewind()
+        self.tempo = 500000 # microseconds per quarter note, 120 bpm until the file says otherwise
+        self.tick = 0
+        self.remainder = 0
+        self.current = None
+        self.playing = 0 # the track being played in a format 2 file
+
+        # statistics
+        self.events = 0
+        self.max_late_us = 0
+
+    def advance(self): # move on to the next event, returns the microseconds until it is due or -1 at the end of the file
+        if (self.current):
+            self.current.next_event()
+        wait = 0
+        while True:
+            track = None
+            if (self.format == 2): # independent sequences, each starting from its own time zero at 120 bpm
+                while (self.playing < len(self.tracks) and self.tracks[self.playing].done):
+                    self.playing = self.playing + 1
+                    self.tick = 0
+                    self.tempo = 500000
+                    self.remainder = 0
+                if (self.playing < len(self.tracks)):
+                    track = self.tracks[self.playing]
+            else:
+                for t in self.tracks: # the track whose next event comes first
+                    if (not t.done and (track is None or t.tick < track.tick)):
+                        track = t
+            if (track is None):
+                self.current = None
+                return -1
+            # convert the ticks since the last event into microseconds at the current tempo
+            if (self.division):
+                total = (track.tick - self.tick) * self.tempo + self.remainder
+                wait = wait + total // self.division
+                self.remainder = total % self.division
+            else:
+                total = (track.tick - self.tick) * 1000000 + self.remainder
+                wait = wait + total // self.ticks_per_second
+                self.remainder = total % self.ticks_per_second
+            self.tick = track.tick
+            if (track.tempo < 0):
+                self.current = track
+                return wait
+            self.tempo = track.tempo
+            track.next_event()
+
+    def emit(self): # feed the current event to the MIDI decoder, byte by byte as if it came from the UART
+        track = self.current
+        for i in range(track.msg_len):
+            self.decoder.read(track.msg[i])
+        self.events = self.events + 1
+
+    def play(self, max_speed = False): # play the whole file, [max_speed] ignores the timing
+        start = ticks_us()
+        due = start
+        while True:
+            wait = self.advance()
+            if (wait < 0):
+                break
+            if (not max_speed):
+                due = ticks_add(due, wait)
+                delay = ticks_diff(due, ticks_us())
+                if (delay > 0):
+                    sleep_us(delay)
+                elif (-delay > self.max_late_us):
+                    self.max_late_us = -delay
+            self.emit()
+        return ticks_diff(ticks_us(), start)
+
+    async def play_async(self, loop = False): # play alongside the other runtime tasks
+        while True:
+            due = ticks_us()
+            while True:
+                wait = self.advance()
+                if (wait < 0):
+                    break
+                due = ticks_add(due, wait)
+                delay = ticks_diff(due, ticks_us())
+                if (delay > 0):
+                    await sleep_ms((delay + 999) // 1000) # rounded up, better a little late than early
+                else:
+                    if (-delay > self.max_late_us):
+                        self.max_late_us = -delay
+                    await sleep_ms(0)
+                self.emit()
+            if (not loop):
+                return
+            self.rewind()
+
+    def close(self):
+        self.f.close()
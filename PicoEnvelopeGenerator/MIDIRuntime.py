@@ -0,0 +1,116 @@
+try:
+    import uasyncio as asyncio
+    from uasyncio import sleep_ms # reuses a single generator, so unlike sleep() and Event.wait() it doesn't allocate
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError: # running on the host
+    import asyncio
+    from HostSim import ticks_ms, ticks_diff, ticks_add
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+# fixed size FIFO between tasks, put() waits while the queue is full so a slow consumer holds up the producer
+class BoundedQueue:
+    def __init__(self, size):
+        self.items = [None] * size
+        self.size = size
+        self.head = 0
+        self.count = 0
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+        # statistics
+        self.puts = 0
+        self.drops = 0     # put_nowait() on a full queue
+        self.waits = 0     # put() had to wait for space (backpressure)
+        self.max_depth = 0
+
+    def any(self):
+        return self.count
+
+    def full(self):
+        return self.count == self.size
+
+    def put_nowait(self, item): # returns False if the queue is full and the item was dropped
+        if (self.count == self.size):
+            self.drops = self.drops + 1
+            return False
+        self.items[(self.head + self.count) % self.size] = item
+        self.count = self.count + 1
+        self.puts = self.puts + 1
+        if (self.count > self.max_depth):
+            self.max_depth = self.count
+        return True
+
+    async def put(self, item):
+        while (self.count == self.size):
+            self.waits = self.waits + 1
+            self.not_full.clear()
+            await self.not_full.wait()
+        self.put_nowait(item)
+
+    def get_nowait(self): # returns None if the queue is empty
+        if (self.count == 0):
+            return None
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head = (self.head + 1) % self.size
+        self.count = self.count - 1
+        self.not_full.set()
+        return item
+
+    def report(self, name):
+        print(name, "puts:", self.puts, "max depth:", self.max_depth, "of", self.size, "waits:", self.waits, "drops:", self.drops)
+
+# uasyncio stream over the UART, the host simulation's VirtualUART brings its own
+def stream(uart):
+    if (hasattr(uart, "stream")):
+        return uart.stream()
+    return asyncio.StreamReader(uart)
+
+class MIDIRuntime:
+    def __init__(self, stream, decoder, sched, rx_size = 64, tick_ms = 1):
+        self.stream = stream
+        self.decoder = decoder
+        self.sched = sched
+        self.rx = BoundedQueue(rx_size) # raw MIDI bytes from the UART
+        self.buf = bytearray(16)
+        self.tick_ms = tick_ms
+        self.bytes_decoded = 0
+
+    async def read_uart(self):
+        while True:
+            n = await self.stream.readinto(self.buf)
+            for i in range(n):
+                if (self.rx.full()): # only wait (and allocate a coroutine) when the decoder is behind
+                    await self.rx.put(self.buf[i])
+                else:
+                    self.rx.put_nowait(self.buf[i])
+
+    async def decode(self): # polls the queue every tick, waiting on an Event would allocate a coroutine on every wake-up
+        while True:
+            n = 0
+            while (self.rx.any()): # decode everything that has arrived before giving up the CPU
+                self.decoder.read(self.rx.get_nowait())
+                n = n + 1
+            self.bytes_decoded = self.bytes_decoded + n
+            # a full queue means the reader is probably waiting with more, so only let the other tasks run first
+            await sleep_ms(0 if n >= self.rx.size else self.tick_ms)
+
+    async def tick(self): # the single tick source, the scheduler runs the envelope, display etc in order of priority
+        due = ticks_ms()
+        while True:
+            self.sched.run()
+            due = ticks_add(due, self.tick_ms)
+            delay = ticks_diff(due, ticks_ms())
+            if (delay < 0): # the tick overran, skip ahead rather than running the missed ticks back to back
+                due = ticks_ms()
+                delay = 0
+            await sleep_ms(delay)
+
+    async def run(self, *tasks): # [tasks] are extra coroutines to run alongside, e.g. a MIDIFilePlayer
+        await asyncio.gather(self.read_uart(), self.decode(), self.tick(), *tasks)
+
+    def report(self):
+        print("bytes decoded:", self.bytes_decoded)
+        self.rx.report("rx")
+        self.sched.report()
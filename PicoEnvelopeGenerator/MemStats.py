@@ -0,0 +1,80 @@
+import gc
+
+try:
+    gc.mem_alloc
+    host = False
+except AttributeError: # running on the host, use tracemalloc instead of the MicroPython heap counters
+    import tracemalloc
+    host = True
+
+class MemStats:
+    def __init__(self, enabled = True, log_events = False):
+        self.enabled = enabled
+        self.log_events = log_events # print the allocations made by every MIDI event
+        self.stats = {} # name: [calls, bytes allocated, most bytes allocated by one call]
+        self.stack = [] # measurements in progress, as [start, peak]
+        self.overhead = 0
+        if (enabled and host and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        if (enabled): # what begin() and end() allocate themselves
+            self.begin()
+            self.overhead = self.end()
+
+    def heap(self):
+        if (host):
+            return tracemalloc.get_traced_memory()[0]
+        return gc.mem_alloc()
+
+    def begin(self):
+        if (host):
+            current, peak = tracemalloc.get_traced_memory()
+            if (self.stack): # keep the outer measurement's peak before resetting it
+                self.stack[-1][1] = max(self.stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.stack.append([current, current])
+        else:
+            if (not self.stack):
+                gc.disable() # nothing gets freed while we measure, so mem_alloc() only goes up
+            self.stack.append([gc.mem_alloc(), 0])
+
+    def end(self): # returns the bytes allocated since the matching begin()
+        start, peak = self.stack.pop()
+        if (host):
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if (self.stack):
+                self.stack[-1][1] = max(self.stack[-1][1], peak)
+            return max(0, peak - start - self.overhead)
+        used = gc.mem_alloc() - start
+        if (not self.stack):
+            gc.enable()
+        return max(0, used - self.overhead)
+
+    def record(self, name, used):
+        stats = self.stats.get(name)
+        if (stats is None):
+            stats = self.stats[name] = [0, 0, 0]
+        stats[0] = stats[0] + 1
+        stats[1] = stats[1] + used
+        if (used > stats[2]):
+            stats[2] = used
+
+    def wrap(self, name, fn, event = False): # returns [fn] with its allocations counted under [name]
+        if (not self.enabled):
+            return fn
+        def measured(*args):
+            self.begin()
+            try:
+                result = fn(*args)
+            finally: # an exception mustn't leave gc disabled or the stack unbalanced
+                used = self.end()
+                self.record(name, used)
+            if (event and self.log_events and used):
+                print("alloc:", name, args, used, "bytes")
+            return result
+        return measured
+
+    def report(self):
+        print("heap used:", self.heap(), "free:", 0 if host else gc.mem_free())
+        for name in self.stats:
+            calls, total, most = self.stats[name]
+            print(" ", name, "calls:", calls, "bytes:", total, "per call:", total // max(calls, 1), "max:", most)
@@ -1,11 +1,13 @@
 import machine
 import time
-from ulab import numpy as np
-import sys
-np.set_printoptions(threshold=sys.maxsize)
+from array import array
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError: # running on the host, see HostSim.py
+    from HostSim import ticks_ms, ticks_diff, ticks_add
 import ssd1306
 from mcp3008 import MCP3008
-
+from EnvelopeStages import EnvelopeStages
 
 class ADCRead:
     def __init__(self):
@@ -19,29 +21,36 @@ class ADCRead:
         self.cs = machine.Pin(17, machine.Pin.OUT)
         self.chip = MCP3008(self.spi, self.cs)
         
-    def update(self):
-        self.a  = int(self.chip.read(7) / 4)
-        self.d   = int(self.chip.read(6) / 4)
-        self.s  = int(self.chip.read(5) * 4)
-        self.r = int(self.chip.read(4) / 4 )        
+    def update(self): # shifts rather than divisions, floats would end up on the heap
+        self.a = self.chip.read(7) >> 2
+        self.d = self.chip.read(6) >> 2
+        self.s = self.chip.read(5) << 2
+        self.r = self.chip.read(4) >> 2
 
 class DACWrite:
     def __init__(self, i2c, calibration = 35500, lowest_note = 40):
-        self.calibration = calibration # calibration offset for reference voltage
         self.lowest_note = lowest_note   # which MIDI note number corresponds to 0V CV
         self.i2c = i2c
-        self.dac = np.array([[0x62,1],  # blue
-                             [0x63,1],  # green
-                             [0x60,0],  # brown
-                             [0x61,0]], dtype=np.uint8) # yellow        
+        self.dac = ((0x62,1),  # blue
+                    (0x63,1),  # green
+                    (0x60,0),  # brown
+                    (0x61,0))  # yellow
+        self.buf = bytearray(2)
+        self.note_cv = array("h", bytes(2 * 128)) # DAC value for every MIDI note
+        self.calibrate(calibration)
+
+    def calibrate(self, calibration): # set the calibration offset for the reference voltage
+        self.calibration = calibration
+        for note in range(128):
+            self.note_cv[note] = self.calculateVoltage(note)
+
     # write to dac
     def update(self, value, dac_number):
-        buf=bytearray(2)
-        buf[0]=(value >> 8) & 0xFF
-        buf[1]=value & 0xFF
-        self.i2c[self.dac[dac_number][1]].writeto(self.dac[dac_number][0], buf)
+        self.buf[0]=(value >> 8) & 0xFF
+        self.buf[1]=value & 0xFF
+        self.i2c[self.dac[dac_number][1]].writeto(self.dac[dac_number][0], self.buf)
     # Calculate the control voltage
-    def noteToVoltage(self, note):
+    def calculateVoltage(self, note):
         reference_voltage = (4.5 + (self.calibration / 65536)) # from 4.5V to 5.5V
         mv = 4096 / reference_voltage / 1000 # value for one mV
         semitone = 83.33 * mv # one semitone is 1V/12 = 83.33mV
@@ -50,57 +59,42 @@ class DACWrite:
         else:
             dacV = int((note-self.lowest_note)*semitone)
         return dacV
+    def noteToVoltage(self, note):
+        return self.note_cv[note]
     # output control voltage for note on CV1
     def playNote(self,note):
         dacV = self.noteToVoltage(note)
         self.update(dacV, 0) # blue
         return dacV
 
-
 class ADSREnvelope:
+    # fixed layout, all state is allocated up front so playing notes doesn't touch the heap
+    __slots__ = ("objADC", "objDAC", "envelope_pos", "release_pos", "do_envelope", "stop_envelope", "note_on",
+                 "current_level", "stages")
+
     def __init__(self, timer, frequency, objADC, objDAC, full_level=4000):
         
         self.objADC = objADC
         self.objDAC = objDAC        
-        self.full_level = full_level
         
         self.envelope_pos = 0
         self.release_pos = 0
         self.do_envelope = False
         self.stop_envelope = False
         self.note_on = False
-
-        self.ad_array = []
-        self.rel_array = []
+        self.current_level = 0 # last value written to CV2, the release starts from here
+        self.stages = EnvelopeStages(full_level)
         
         # set up timer
         timer.init(period = frequency, callback = self.update)        
 
-    def attack_decay(self): # generate attack/decay array
-        if(self.objADC.a<2):
-            attack_arr = np.full((1, ), self.full_level, dtype=np.uint16)
-        else:
-            attack_arr = np.linspace(0, self.full_level, self.objADC.a, endpoint = False, dtype=np.uint16)
-        if(self.objADC.d<2):
-            decay_arr = np.full((1, ), self.objADC.s, dtype=np.uint16)
-        else:
-            decay_arr = np.linspace(self.full_level, self.objADC.s, self.objADC.d, endpoint = False, dtype=np.uint16)
-        self.ad_array = np.concatenate((attack_arr, decay_arr), axis=0)
-
-    def release(self): # generate release array
-        global aLen, rLen
-        if(self.objADC.r<2):
-            self.rel_array = np.full((1, ), 0, dtype=np.uint16)
-        else:
-            self.rel_array = np.linspace(self.ad_array[self.envelope_pos-1], 0, self.objADC.r, dtype=np.uint16)
-    
     def trigger(self): # trigger the envelope from the start
         self.envelope_pos = 0
         self.release_pos = 0
         self.do_envelope = True
         self.note_on = True
         self.objADC.update()
-        self.attack_decay()
+        self.stages.attack_decay(self.objADC.a, self.objADC.d, self.objADC.s)
         
     def stop(self): # initiate release phase of the envelope
         self.note_on = False
@@ -109,32 +103,31 @@ class ADSREnvelope:
     def update(self, tim): # must be run in the loop
         if (self.do_envelope):
             if (self.note_on): # we're playing a note, but where are we in the evelope?
-                if (self.envelope_pos<len(self.ad_array)): # we're in the attack/decay section
+                if (self.envelope_pos<self.stages.ad_len): # we're in the attack/decay section
                     self.envelope_pos = self.envelope_pos + 1
-                    out = int(self.ad_array[self.envelope_pos-1])
+                    out = self.stages.ad_array[self.envelope_pos-1]
                 else:
                     out = self.objADC.s # we're in the sustain section                    
             else: # we're not playing a note any more, are we in the release section?
                 if(self.stop_envelope): # not yet, let's set it up
                     self.stop_envelope = False
-                    self.release() # self.ad_array[self.envelope_pos-1],self.objADC.r
+                    self.stages.release(self.current_level, self.objADC.r)
                     
-                if (self.release_pos<len(self.rel_array)-1): # we are in the release phase
+                if (self.release_pos<self.stages.rel_len-1): # we are in the release phase
                     self.release_pos = self.release_pos + 1
-                    out = int(self.rel_array[self.release_pos])
+                    out = self.stages.rel_array[self.release_pos]
                 else: # we have finished the release phase
                     out = 0
                     self.do_envelope = False
+            self.current_level = out
             self.objDAC.update(out, 1) # output to CV2
         
 class OLEDDisplay:
-    def __init__(self, timer, frequency, objADC, i2c):
+    def __init__(self, timer, frequency, objADC, i2c, chunk = 32):
         
         self.objADC = objADC
         self.i2c = i2c
-                
-        # set up timer
-        timer.init(period = frequency, callback = self.update)
+        self.frequency = frequency # ms between frames
         
         # set up oled
         self.oled = ssd1306.SSD1306_I2C(128, 64, self.i2c)
@@ -144,6 +137,16 @@ class OLEDDisplay:
         self.yMax = 63
         self.sustainTime = 40        
 
+        # a whole frame takes 23ms on the 400kHz bus, so it goes out [chunk] bytes per tick (32 bytes take about 0.75ms)
+        # the slices are made up front, slicing the memoryview on every tick would allocate
+        buf = memoryview(self.oled.buffer)
+        self.chunks = [buf[i:i + chunk] for i in range(0, len(buf), chunk)]
+        self.next_chunk = len(self.chunks) # nothing to send
+        self.next_frame = ticks_ms()
+        
+        # set up timer, this runs every tick and sends the next chunk of the frame
+        timer.init(period = 1, callback = self.update)
+
     def draw_envelope(self):
         self.objADC.update()
         self.oled.text("A  D  S  R", 0, 0)
@@ -157,10 +160,22 @@ class OLEDDisplay:
         self.oled.line(attackTime + decayTime, self.yMax - sustainLevel, attackTime + decayTime + self.sustainTime, self.yMax - sustainLevel, 1) # draw decay line
         self.oled.line(attackTime + decayTime + self.sustainTime, self.yMax - sustainLevel, attackTime + decayTime + self.sustainTime + releaseTime, self.yMax, 1) # draw release line
 
+    def show(self): # same as SSD1306.show(), but only sets the address window, update() sends the data
+        for cmd in (0x21, 0, 127, 0x22, 0, 7): # column address 0 - 127, page address 0 - 7
+            self.oled.write_cmd(cmd)
+        self.next_chunk = 0
+
     def update(self, tim): # this is run periodically by the timer
+        if (self.next_chunk < len(self.chunks)): # a frame is on its way out
+            self.oled.write_data(self.chunks[self.next_chunk])
+            self.next_chunk = self.next_chunk + 1
+            return
+        if (ticks_diff(ticks_ms(), self.next_frame) < 0):
+            return
+        self.next_frame = ticks_add(ticks_ms(), self.frequency)
         self.oled.fill(0)
         self.draw_envelope()
-        self.oled.show()
+        self.show()
 
 # pad string [s] with [width] leading zeros
 def zfl(s, width):
@@ -26,14 +26,29 @@
 
 import machine
 import time
-import ustruct
 import SimpleMIDIDecoder
 from neopixel import Neopixel
-from ulab import numpy as np
-import sys
-np.set_printoptions(threshold=sys.maxsize)
+from LEDRing import LEDRing
+from SensorFilter import SensorFilter
+from Scheduler import Scheduler
+from MIDIRuntime import MIDIRuntime, stream
+from EnvelopeStages import EnvelopeStages
+from MemStats import MemStats
+try:
+    import uasyncio as asyncio
+except ImportError: # running on the host, see HostSim.py
+    import asyncio
 from mcp3008 import MCP3008
 
+# set up the scheduler, all periodic work runs from a single 1ms tick task in order of priority
+# (0 = envelope, 2 = sensors, 8 = LEDs/display which wait for the next tick if time is short)
+sched = Scheduler(1, 800)
+
+# set to True to log the heap allocations per subsystem and per MIDI event (slows everything down)
+mem = MemStats(enabled = False, log_events = True)
+if (mem.enabled):
+    sched.add("memory", lambda t: mem.report(), 10000, 9, True) # print the statistics every 10 seconds
+
 # set up Neopixel ring
 neopixel_count = 16
 neopixel_pin = 16
@@ -44,16 +59,19 @@ green = (0, 255, 0)
 strip.brightness(50)
 strip.fill(black)
 strip.show()
+leds_timer = sched.timer("leds", 8, True)
+leds = LEDRing(leds_timer, 40, strip, neopixel_count, green, yellow, black)
+leds_timer.init(period = 40, callback = mem.wrap("leds", leds.update)) # redraw at most 25 times a second
 
 # set up global variables
 calibration = 0    # calibration offset for reference voltage
 lowest_note = 40   # which MIDI note number corresponds to 0V CV
-old_num_pixels = 0 # previous number of neopixels shown
 
 # set up analogue inputs
 analog0_value = machine.ADC(26)
 analog1_value = machine.ADC(27)
 analog2_value = machine.ADC(28)
+distance_sensor = SensorFilter(analog1_value, 4, 2, 56, 64) # 16x oversampling, smoothing, deadband, slew
 
 # set up 10-bit analogue inputs
 spi = machine.SPI(0, sck=machine.Pin(18),mosi=machine.Pin(19),miso=machine.Pin(16), baudrate=100000)
@@ -71,51 +89,32 @@ i2c = [machine.I2C(0,sda=machine.Pin(8), scl=machine.Pin(9), freq=400000), machi
 uart = machine.UART(0,31250,tx=machine.Pin(12),rx=machine.Pin(13)) # UART0 on pins 12,13
 
 envelope_pos = 0
+release_pos = 0
 do_envelope = False
 start_envelope = False
 stop_envelope = False
 note_on = False # is a note played at the moment?
 sustain_level = 0
 release_length = 0
+current_level = 0 # last value written to the DAC, the release starts from here
 #env = [1,2,4,8,16,12,10,8,8,8,8,6,4,2,2,1]
-ad_array = [0, 100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300, 2400, 2500, 2600, 2700, 2800, 2900, 3000, 2925, 2850, 2775, 2700, 2625, 2550, 2475, 2400, 2325, 2250, 2175, 2100, 2025, 1950, 1875, 1800, 1725, 1650, 1575, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1500, 1461, 1423, 1384, 1346, 1307, 1269, 1230, 1192, 1153, 1115, 1076, 1038, 999, 961, 923, 884, 846, 807, 769, 730, 692, 653, 615, 576, 538, 499, 461, 423, 384, 346, 307, 269, 230, 192, 153, 115, 76, 38, 0]
-rel_array = []
+stages = EnvelopeStages() # the attack/decay and release phases
 
 # timer callback functions:
 
 # calibration
 def check_calibration_pot(t):
-    global calibration
-    calibration = analog0_value.read_u16()
+    set_calibration(analog0_value.read_u16())
 
 # distance sensor
 def check_distance_sensor(t):
-    distance = analog1_value.read_u16() / 16  
-    writeToDac(int(distance),0x63,1)
+    distance = distance_sensor.update()
+    if (distance is not None): # only write to the DAC if the value has changed
+        writeToDac(distance,0x63,1)
     #convert to number from 0 - 16
-    numLEDs = 16 - int(distance / 256)
+    numLEDs = 16 - int(distance_sensor.value / 256)
     neopixelDraw(numLEDs, 10)
 
-# envelope generator functions
-def attack_decay(attack_length = 30, decay_length = 20, sustain_level = 1500, full_level = 4000):
-    if(attack_length<2):
-        attack_arr = np.full((1, ), full_level, dtype=np.uint16)
-    else:
-        attack_arr = np.linspace(0, full_level, attack_length, endpoint = False, dtype=np.uint16)
-    if(decay_length<2):
-        decay_arr = np.full((1, ), sustain_level, dtype=np.uint16)
-    else:
-        decay_arr = np.linspace(full_level, sustain_level, decay_length, endpoint = False, dtype=np.uint16)
-    ad = np.concatenate((attack_arr, decay_arr), axis=0)
-    return ad
-
-def release (current_level = 1500, release_length = 40):
-    if(release_length<2):
-        release_arr = np.full((1, ), 0, dtype=np.uint16)
-    else:
-        release_arr = np.linspace(sustain_level, 0, release_length, dtype=np.uint16)
-    return release_arr
-
 # envelope
 def envelope(t):
     global start_envelope
@@ -123,89 +122,87 @@ def envelope(t):
     global do_envelope
     global envelope_pos
     global release_pos
-    global ad_array
-    global rel_array
     global release_length
     global sustain_level
+    global current_level
     if (start_envelope):
         
         envelope_pos = 0
         release_pos = 0
         
-        attack_length  = int(chip.read(7) / 4)
-        decay_length   = int(chip.read(6) / 4)
-        sustain_level  = int(chip.read(5) * 4)
-        release_length = int(chip.read(4) / 4 )
+        attack_length  = chip.read(7) >> 2 # shifts rather than divisions, floats would end up on the heap
+        decay_length   = chip.read(6) >> 2
+        sustain_level  = chip.read(5) << 2
+        release_length = chip.read(4) >> 2
+        stages.attack_decay(attack_length, decay_length, sustain_level)
         
-        ad_array = attack_decay(attack_length, decay_length,sustain_level)
-        
-        print("attack",attack_length,"decay",decay_length,"sustain",sustain_level,"release",release_length)
         do_envelope = True
         start_envelope = False
         
     if (do_envelope):
         if (note_on):
-            if (envelope_pos<len(ad_array)): # we're in the attack/decay section
+            if (envelope_pos<stages.ad_len): # we're in the attack/decay section
                 envelope_pos = envelope_pos + 1
-                out = int(ad_array[envelope_pos-1])
+                out = stages.ad_array[envelope_pos-1]
             else:
                 out = sustain_level # we're in the sustain section
             
         else: # we're in the release section
             if(stop_envelope):
                 stop_envelope = False
-                rel_array = release(ad_array[envelope_pos-1],release_length)
-            if (release_pos<len(rel_array)-1):
+                stages.release(current_level, release_length)
+            if (release_pos<stages.rel_len-1):
                 release_pos = release_pos + 1
-                out = int(rel_array[release_pos])
+                out = stages.rel_array[release_pos]
             else:
                 out = 0
                 do_envelope = False
+        current_level = out
         writeToDac(out,0x60,0)
         
 
 # set up timers
-#distance_timer = machine.Timer()
+#distance_timer = sched.timer("distance", 2)
 #distance_timer.init (period = 50, mode = machine.Timer.PERIODIC, callback = check_distance_sensor)
 if (not calibration): # only check the calibration pot if there isn't a hard coded calibration value
-    calibration_timer = machine.Timer()
-    calibration_timer.init (period = 100, mode = machine.Timer.PERIODIC, callback = check_calibration_pot)
-envelope_timer = machine.Timer()
-envelope_timer.init (period = 2, mode = machine.Timer.PERIODIC, callback = envelope)
+    calibration_timer = sched.timer("calibration", 2)
+    calibration_timer.init (period = 100, mode = machine.Timer.PERIODIC, callback = mem.wrap("calibration", check_calibration_pot))
+envelope_timer = sched.timer("envelope", 0)
+envelope_timer.init (period = 2, mode = machine.Timer.PERIODIC, callback = mem.wrap("envelope", envelope))
 
-# draw to neopixel ring 
+# draw to neopixel ring (the LED timer only pushes the frame out if it has changed)
 def neopixelDraw (num_pixels, bright):
-    global old_num_pixels
-    strip.brightness(bright)
-    # only redraw if the value has changed
-    if(num_pixels == old_num_pixels or num_pixels > neopixel_count):
-        return
-    old_num_pixels = num_pixels
-    # draw the pixels
-    strip.fill(black)
-    if (num_pixels == 1):
-        strip.set_pixel(0,green)
-    elif (num_pixels > 1):
-        strip.set_pixel_line_gradient(0, num_pixels-1, green, yellow)
-    strip.show()  
+    leds.draw(num_pixels, bright)
 
 # DAC function
+dac_buf = bytearray(2) # preallocated, so writing to the DAC doesn't allocate
 def writeToDac(value,addr, i2cBus):
-    buf=bytearray(2)
-    buf[0]=(value >> 8) & 0xFF
-    buf[1]=value & 0xFF
-    i2c[i2cBus].writeto(addr,buf)
+    dac_buf[0]=(value >> 8) & 0xFF
+    dac_buf[1]=value & 0xFF
+    i2c[i2cBus].writeto(addr,dac_buf)
     
-# Calculate the control voltage
-def noteToVoltage(note):
+# Calculate the size of a semitone for the calibration offset, in 1/65536ths of a DAC step
+# (done when the calibration changes rather than on every note, the float maths would allocate)
+semitone = 0
+def set_calibration(value):
+    global calibration, semitone
+    if (semitone and abs(value - calibration) < 64): # ADC jitter rather than a turn of the pot, about 1mV of reference
+        return
+    calibration = value
     reference_voltage = (4.5 + (calibration / 65536)) # from 4.5V to 5.5V
     mv = 4096 / reference_voltage / 1000 # value for one mV
-    semitone = 83.33 * mv # one semitone is 1V/12 = 83.33mV
+    semitone = int(83.33 * mv * 65536) # one semitone is 1V/12 = 83.33mV
+
+# Calculate the control voltage
+def noteToVoltage(note):
     if(note == 0):
         dacV = 0
+    elif(note < lowest_note):
+        dacV = -(((lowest_note-note)*semitone) >> 16)
     else:
-        dacV = int((note-lowest_note)*semitone)
+        dacV = ((note-lowest_note)*semitone) >> 16
     return dacV
+set_calibration(calibration)
 
 # output control voltage for note on CV1
 def playNote(note):
@@ -216,11 +213,18 @@ def playNote(note):
     return dacV
 
 # MIDI Thru
+thru2 = bytearray(2) # preallocated, so passing messages on doesn't allocate
+thru3 = bytearray(3)
 def midi_send(cmd, ch, b1, b2):
     if (b2 == -1):
-        uart.write(ustruct.pack("bb",cmd+ch,b1))
+        thru2[0] = (cmd+ch) & 0xFF
+        thru2[1] = b1
+        uart.write(thru2)
     else:
-        uart.write(ustruct.pack("bbb",cmd+ch,b1,b2))
+        thru3[0] = (cmd+ch) & 0xFF
+        thru3[1] = b1
+        thru3[2] = b2
+        uart.write(thru3)
         
 # MIDI callback routines
 def doMidiNoteOn(ch, cmd, note, vel):
@@ -244,12 +248,13 @@ def doMidiThru(ch, cmd, d1, d2):
 
 # initialise MIDI decoder and set up callbacks
 md = SimpleMIDIDecoder.SimpleMIDIDecoder()
-md.cbNoteOn (doMidiNoteOn)
-md.cbNoteOff (doMidiNoteOff)
-md.cbThru (doMidiThru)
-
-# the loop
-while True:
-    # Check for MIDI messages
-    if (uart.any()):
-        md.read(uart.read(1)[0])
+md.cbNoteOn (mem.wrap("note on", doMidiNoteOn, True))
+md.cbNoteOff (mem.wrap("note off", doMidiNoteOff, True))
+md.cbThru (mem.wrap("thru", doMidiThru, True))
+md.read = mem.wrap("decode", md.read)
+
+# the UART reader, MIDI decoder and scheduler tick run as separate tasks
+runtime = MIDIRuntime(stream(uart), md, sched)
+if __name__ == "__main__":
+    asyncio.run(runtime.run())
+
@@ -0,0 +1,67 @@
+class SensorFilter:
+    def __init__(self, adc, oversample = 4, smoothing = 2, deadband = 56, slew = 0):
+        self.adc = adc
+        self.oversample = oversample # take 2^oversample ADC readings per update
+        self.smoothing = smoothing   # one-pole filter, each update moves 1/2^smoothing of the way
+        self.deadband = deadband     # a change this big (in 12-bit DAC steps) means the hand moved, has to be above the
+                                     # filtered noise: with 16x oversampling and smoothing 2 that's about 9 steps rms, 70 peak to peak
+        self.slew = slew             # maximum change per update (0 = jump straight to the new value)
+
+        self.acc = -1    # filter accumulator, scaled by 2^smoothing, -1 until the first reading
+        self.tracking = True # following the filtered reading until it settles
+        self.anchor = 0  # filtered reading the settling is measured from
+        self.total = 0   # sum and count of the readings since then, their mean is where it settled
+        self.count = 0
+        self.target = 0  # value the output is heading for
+        self.value = 0   # current output (12-bit)
+        self.written = -1 # last value handed out for the DAC
+
+    def read(self): # average a burst of readings, returns a 16-bit value
+        total = 0
+        for i in range(1 << self.oversample):
+            total = total + self.adc.read_u16()
+        return total >> self.oversample
+
+    def update(self): # returns the new 12-bit value if the DAC needs writing, otherwise None
+        sample = self.read()
+        if (self.acc < 0):
+            self.acc = sample << self.smoothing
+        else:
+            self.acc = self.acc + sample - (self.acc >> self.smoothing)
+        filtered = (self.acc >> self.smoothing) >> 4 # 16-bit to 12-bit
+        if (not self.tracking and abs(filtered - self.target) >= self.deadband): # the hand moved, follow it
+            self.tracking = True
+            self.count = 0
+        if (self.tracking and (self.count == 0 or abs(filtered - self.anchor) >= self.deadband >> 1)): # still moving
+            self.anchor = filtered
+            self.total = 0
+            self.count = 0
+        self.total = self.total + sample
+        self.count = self.count + 1
+        if (self.count == 128): # keep averaging but let the oldest readings go
+            self.total = self.total >> 1
+            self.count = 64
+        mean = (self.total // self.count) >> 4
+        if (self.tracking):
+            if (self.count < 4):
+                self.target = filtered
+            else: # settled, hold the average of the readings since instead of a noisy one
+                self.tracking = False
+                self.target = mean
+        elif (self.count >= 16 and abs(mean - self.target) >= self.deadband >> 3): # the average firms up, and moves
+            self.target = mean                                                       # under the deadband get through slowly
+        # slew towards the target
+        if (self.slew and self.written >= 0):
+            if (self.target > self.value + self.slew):
+                self.value = self.value + self.slew
+            elif (self.target < self.value - self.slew):
+                self.value = self.value - self.slew
+            else:
+                self.value = self.target
+        else:
+            self.value = self.target
+        # only write to the DAC if the output has actually changed
+        if (self.value == self.written):
+            return None
+        self.written = self.value
+        return self.value
@@ -69,8 +69,9 @@ md = SimpleMIDIDecoder.SimpleMIDIDecoder()
 md.cbNoteOn (doMidiNoteOn)
 md.cbNoteOff (doMidiNoteOff)
 
-# the loop
-while True:
-    # Check for MIDI messages
-    if (uart.any()):
-        md.read(uart.read(1)[0])
\ No newline at end of file
+# the loop (only when run on the Pico, so the host benchmarks can import the script)
+if __name__ == "__main__":
+    while True:
+        # Check for MIDI messages
+        if (uart.any()):
+            md.read(uart.read(1)[0])
\ No newline at end of file
@@ -0,0 +1,52 @@
+class LEDRing:
+    def __init__(self, timer, frequency, strip, count, colour_from, colour_to, background=(0, 0, 0)):
+
+        self.strip = strip
+        self.count = count
+        self.background = background
+
+        # precompute the gradient for every possible number of lit pixels (0 - count)
+        self.palette = [self.gradient(n, colour_from, colour_to) for n in range(count + 1)]
+
+        self.num_pixels = 0 # requested frame
+        self.bright = 0
+        self.shown_pixels = -1 # frame currently on the strip, -1 forces the first draw
+        self.shown_bright = -1
+        self.shows = 0 # number of frames pushed out through PIO
+
+        # set up timer, this bounds the frame rate independently of whoever calls draw()
+        timer.init(period = frequency, callback = self.update)
+
+    def gradient(self, num_pixels, colour_from, colour_to): # same maths as Neopixel.set_pixel_line_gradient
+        if (num_pixels == 0):
+            return []
+        if (num_pixels == 1):
+            return [colour_from]
+        colours = []
+        for i in range(num_pixels):
+            fraction = i / (num_pixels - 1)
+            colours.append(tuple(round((colour_to[c] - colour_from[c]) * fraction + colour_from[c]) for c in range(len(colour_from))))
+        return colours
+
+    def draw(self, num_pixels, bright): # request a frame, cheap enough to call on every sensor reading
+        if (num_pixels < 0 or num_pixels > self.count):
+            return
+        self.num_pixels = num_pixels
+        self.bright = bright
+
+    def update(self, tim): # this is run periodically by the timer
+        num_pixels = self.num_pixels
+        bright = self.bright
+        # only push a frame if the pixels or the brightness have changed
+        if (num_pixels == self.shown_pixels and bright == self.shown_bright):
+            return
+        if (bright != self.shown_bright):
+            self.strip.brightness(bright)
+            self.shown_bright = bright
+        self.shown_pixels = num_pixels
+        self.strip.fill(self.background)
+        colours = self.palette[num_pixels]
+        for i in range(num_pixels):
+            self.strip.set_pixel(i, colours[i])
+        self.strip.show()
+        self.shows = self.shows + 1
@@ -29,6 +29,24 @@ import time
 import ustruct
 import SimpleMIDIDecoder
 from neopixel import Neopixel
+from LEDRing import LEDRing
+from SensorFilter import SensorFilter
+from Scheduler import Scheduler
+from MIDIRuntime import MIDIRuntime, stream
+from MemStats import MemStats
+try:
+    import uasyncio as asyncio
+except ImportError: # running on the host, see PicoEnvelopeGenerator/HostSim.py
+    import asyncio
+
+# set up the scheduler, all periodic work runs from a single 1ms tick task in order of priority
+# (2 = sensors, 8 = LEDs which wait for the next tick if time is short)
+sched = Scheduler(1, 800)
+
+# set to True to log the heap allocations per subsystem and per MIDI event (slows everything down)
+mem = MemStats(enabled = False, log_events = True)
+if (mem.enabled):
+    sched.add("memory", lambda t: mem.report(), 10000, 9, True) # print the statistics every 10 seconds
 
 # set up Neopixel ring
 neopixel_count = 16
@@ -40,16 +58,19 @@ green = (0, 255, 0)
 strip.brightness(50)
 strip.fill(black)
 strip.show()
+leds_timer = sched.timer("leds", 8, True)
+leds = LEDRing(leds_timer, 40, strip, neopixel_count, green, yellow, black)
+leds_timer.init(period = 40, callback = mem.wrap("leds", leds.update)) # redraw at most 25 times a second
 
 # set up global variables
 calibration = 0    # calibration offset for reference voltage
 lowest_note = 40   # which MIDI note number corresponds to 0V CV
-old_num_pixels = 0 # previous number of neopixels shown
 
 # set up analogue inputs
 analog0_value = machine.ADC(26)
 analog1_value = machine.ADC(27)
 analog2_value = machine.ADC(28)
+distance_sensor = SensorFilter(analog1_value, 4, 2, 56, 64) # 16x oversampling, smoothing, deadband, slew
 
 # set up gate pin
 gate = machine.Pin(17, machine.Pin.OUT)
@@ -70,33 +91,22 @@ def check_calibration_pot(t):
 
 # distance sensor
 def check_distance_sensor(t):
-    distance = analog1_value.read_u16() / 16  
-    writeToDac(int(distance),0x63,1)
+    distance = distance_sensor.update()
+    if (distance is not None): # only write to the DAC if the value has changed
+        writeToDac(distance,0x63,1)
     #convert to number from 0 - 16
-    numLEDs = 16 - int(distance / 256)
+    numLEDs = 16 - int(distance_sensor.value / 256)
     neopixelDraw(numLEDs, 10)
     
 # set up timers
-distance_timer = machine.Timer()
-distance_timer.init (period = 50, mode = machine.Timer.PERIODIC, callback = check_distance_sensor)
-calibration_timer = machine.Timer()
-calibration_timer.init (period = 100, mode = machine.Timer.PERIODIC, callback = check_calibration_pot)
+distance_timer = sched.timer("distance", 2)
+distance_timer.init (period = 50, mode = machine.Timer.PERIODIC, callback = mem.wrap("distance", check_distance_sensor))
+calibration_timer = sched.timer("calibration", 2)
+calibration_timer.init (period = 100, mode = machine.Timer.PERIODIC, callback = mem.wrap("calibration", check_calibration_pot))
 
-# draw to neopixel ring 
+# draw to neopixel ring (the LED timer only pushes the frame out if it has changed)
 def neopixelDraw (num_pixels, bright):
-    global old_num_pixels
-    strip.brightness(bright)
-    # only redraw if the value has changed
-    if(num_pixels == old_num_pixels or num_pixels > neopixel_count):
-        return
-    old_num_pixels = num_pixels
-    # draw the pixels
-    strip.fill(black)
-    if (num_pixels == 1):
-        strip.set_pixel(0,green)
-    elif (num_pixels > 1):
-        strip.set_pixel_line_gradient(0, num_pixels-1, green, yellow)
-    strip.show()  
+    leds.draw(num_pixels, bright)
 
 # DAC function
 def writeToDac(value,addr, i2cBus):
@@ -129,11 +139,11 @@ def doMidiNoteOff(ch, cmd, note, vel):
 
 # initialise MIDI decoder and set up callbacks
 md = SimpleMIDIDecoder.SimpleMIDIDecoder()
-md.cbNoteOn (doMidiNoteOn)
-md.cbNoteOff (doMidiNoteOff)
-
-# the loop
-while True:
-    # Check for MIDI messages
-    if (uart.any()):
-        md.read(uart.read(1)[0])
\ No newline at end of file
+md.cbNoteOn (mem.wrap("note on", doMidiNoteOn, True))
+md.cbNoteOff (mem.wrap("note off", doMidiNoteOff, True))
+md.read = mem.wrap("decode", md.read)
+
+# the UART reader, MIDI decoder and scheduler tick run as separate tasks
+runtime = MIDIRuntime(stream(uart), md, sched)
+if __name__ == "__main__":
+    asyncio.run(runtime.run())
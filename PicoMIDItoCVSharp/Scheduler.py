@@ -0,0 +1,124 @@
+try:
+    from time import ticks_us, ticks_diff, ticks_add
+except ImportError: # running on the host, see HostSim.py
+    from HostSim import ticks_us, ticks_diff, ticks_add
+
+ONE_SHOT = 0 # same values as machine.Timer
+PERIODIC = 1
+
+class Task:
+    def __init__(self, name, callback, period_us, priority, deferrable):
+        self.name = name
+        self.callback = callback
+        self.period_us = period_us # 0 for one-shot tasks
+        self.priority = priority   # lower numbers run first
+        self.deferrable = deferrable # may be pushed to the next tick when the budget is used up
+        self.deadline = 0
+
+        # statistics
+        self.runs = 0
+        self.misses = 0      # deadlines missed by a whole period (or tick for one-shot tasks)
+        self.deferred = 0    # times the task was put off because the tick budget was used up
+        self.max_late_us = 0
+        self.max_run_us = 0
+
+# drop-in for machine.Timer, so classes that take a timer can be run by the scheduler
+class SchedulerTimer:
+    def __init__(self, scheduler, name, priority, deferrable):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+        self.deferrable = deferrable
+        self.task = None
+
+    def init(self, period = 1000, mode = PERIODIC, callback = None):
+        self.deinit()
+        if (mode == PERIODIC):
+            self.task = self.scheduler.add(self.name, callback, period, self.priority, self.deferrable)
+        else:
+            self.task = self.scheduler.once(self.name, callback, period, self.priority, self.deferrable)
+
+    def deinit(self):
+        if (self.task):
+            self.scheduler.remove(self.task)
+            self.task = None
+
+# run() is called once per tick by a single tick source, MIDIRuntime.tick() on the Pico, so all tasks run in the
+# main context between the other asyncio tasks rather than in timer interrupts
+class Scheduler:
+    def __init__(self, tick_ms = 1, budget_us = 800):
+        self.tick_us = tick_ms * 1000
+        self.budget_us = budget_us # time after which deferrable tasks wait for the next tick
+        self.tasks = [] # ordered by priority
+
+        # statistics
+        self.ticks = 0
+        self.max_tick_us = 0
+
+    def add(self, name, callback, period_ms, priority, deferrable = False): # periodic task
+        task = Task(name, callback, period_ms * 1000, priority, deferrable)
+        task.deadline = ticks_add(ticks_us(), task.period_us)
+        self.insert(task)
+        return task
+
+    def once(self, name, callback, delay_ms, priority, deferrable = False): # one-shot task
+        task = Task(name, callback, 0, priority, deferrable)
+        task.deadline = ticks_add(ticks_us(), delay_ms * 1000)
+        self.insert(task)
+        return task
+
+    def insert(self, task):
+        i = 0
+        while (i < len(self.tasks) and self.tasks[i].priority <= task.priority):
+            i = i + 1
+        self.tasks.insert(i, task)
+
+    def remove(self, task):
+        if (task in self.tasks):
+            self.tasks.remove(task)
+
+    def timer(self, name, priority, deferrable = False):
+        return SchedulerTimer(self, name, priority, deferrable)
+
+    def run(self): # run all due tasks in order of priority
+        start = ticks_us()
+        self.ticks = self.ticks + 1
+        ran = False
+        i = 0
+        while (i < len(self.tasks)): # no list copies here, this runs every tick
+            task = self.tasks[i]
+            i = i + 1
+            now = ticks_us()
+            late = ticks_diff(now, task.deadline)
+            if (late < 0):
+                continue # not due yet
+            # deferrable tasks wait for the next tick if their longest run so far wouldn't fit in what's left of the
+            # budget, unless nothing else has run in this tick (so a task longer than the budget still gets to run)
+            if (task.deferrable and ran and ticks_diff(now, start) + task.max_run_us > self.budget_us):
+                task.deferred = task.deferred + 1
+                continue
+            if (late > task.max_late_us):
+                task.max_late_us = late
+            if (late >= (task.period_us or self.tick_us)):
+                task.misses = task.misses + 1
+            task.callback(task)
+            task.runs = task.runs + 1
+            ran = True
+            took = ticks_diff(ticks_us(), now)
+            if (took > task.max_run_us):
+                task.max_run_us = took
+            if (task.period_us):
+                task.deadline = ticks_add(task.deadline, task.period_us)
+                if (ticks_diff(ticks_us(), task.deadline) >= 0): # we've fallen a whole period behind, skip ahead
+                    task.deadline = ticks_add(ticks_us(), task.period_us)
+            else:
+                self.remove(task)
+                i = i - 1
+        took = ticks_diff(ticks_us(), start)
+        if (took > self.max_tick_us):
+            self.max_tick_us = took
+
+    def report(self):
+        print("ticks:", self.ticks, "max tick us:", self.max_tick_us)
+        for task in self.tasks:
+            print(" ", task.name, "runs:", task.runs, "misses:", task.misses, "deferred:", task.deferred, "max late us:", task.max_late_us, "max run us:", task.max_run_us)